@@ -0,0 +1,313 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+
+from main import KeilProjectManager, RunStats, stream_project_listing, select_xml_backend, lxml_etree
+
+# 预设规模：Target数、已有组数、每组文件数、Include路径数、源码树目录数、每目录文件数
+SIZES = {
+    'small': dict(targets=2, groups=20, files_per_group=20, include_paths=20, dirs=50, files_per_dir=10),
+    'medium': dict(targets=4, groups=100, files_per_group=50, include_paths=100, dirs=300, files_per_dir=20),
+    'large': dict(targets=8, groups=300, files_per_group=100, include_paths=300, dirs=1500, files_per_dir=20),
+}
+
+OPERATIONS = ('add', 'add-recursive', 'delete', 'delete-group', 'list', 'list-snapshot', 'save')
+
+
+def generate_project(project_file, targets, groups, files_per_group, include_paths):
+    """生成合成的.uvprojx工程文件"""
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8" standalone="no" ?>',
+        '<Project xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="project_projx.xsd">',
+        '',
+        '  <SchemaVersion>2.1</SchemaVersion>',
+        '',
+        '  <Targets>',
+    ]
+    includes = ';'.join(f'../Existing/Inc{i}' for i in range(include_paths))
+    for t in range(targets):
+        lines += [
+            '    <Target>',
+            f'      <TargetName>Target{t}</TargetName>',
+            '      <TargetOption>',
+            '        <TargetArmAds>',
+            '          <Cads>',
+            '            <VariousControls>',
+            '              <MiscControls></MiscControls>',
+            f'              <Define>USE_HAL_DRIVER,TARGET{t}</Define>',
+            f'              <IncludePath>{includes}</IncludePath>',
+            '            </VariousControls>',
+            '          </Cads>',
+            '        </TargetArmAds>',
+            '      </TargetOption>',
+            '      <Groups>',
+        ]
+        for g in range(groups):
+            lines += [
+                '        <Group>',
+                f'          <GroupName>Existing{g}</GroupName>',
+                '          <Files>',
+            ]
+            for f in range(files_per_group):
+                lines += [
+                    '            <File>',
+                    f'              <FileName>file{f}.c</FileName>',
+                    '              <FileType>1</FileType>',
+                    f'              <FilePath>../Existing/Src{g}/file{f}.c</FilePath>',
+                    '            </File>',
+                ]
+            lines += ['          </Files>', '        </Group>']
+        lines += ['      </Groups>', '    </Target>']
+    lines += ['  </Targets>', '', '</Project>', '']
+    with open(project_file, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+
+
+def generate_source_tree(root, dirs, files_per_dir, fanout=4):
+    """生成类似厂商SDK的源码树：多层目录，源文件与头文件混合"""
+    paths = [root]
+    os.makedirs(root, exist_ok=True)
+    for i in range(1, dirs):
+        parent = paths[(i - 1) // fanout]
+        path = os.path.join(parent, f'mod{i}')
+        os.makedirs(path, exist_ok=True)
+        paths.append(path)
+    for d, path in enumerate(paths):
+        for f in range(files_per_dir):
+            # 约三分之一为头文件
+            ext = '.h' if f % 3 == 0 else '.c'
+            with open(os.path.join(path, f'm{d}_f{f}{ext}'), 'w') as fp:
+                fp.write(f'#include "m{d}_f0.h"\n' if ext == '.c' else '')
+    return paths
+
+
+def measure(func, memory=True):
+    """执行操作并返回 (耗时秒数, 峰值内存KB, 返回值, 计数器)；操作接收一个RunStats，内存在单独一次运行中测量"""
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        stats = RunStats()
+        start = time.perf_counter()
+        result = func(stats)
+        seconds = time.perf_counter() - start
+        peak_kb = None
+        if memory:
+            tracemalloc.start()
+            func(RunStats())
+            peak_kb = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+    return seconds, peak_kb, result, stats.as_dict()['counters']
+
+
+def run_size(size_name, params, workdir, operations, memory=True, backend='etree'):
+    """在一个规模下使用指定XML后端运行所有操作，返回结果列表"""
+    select_xml_backend(backend)
+    base_project = os.path.join(workdir, 'base', 'MDK', 'bench.uvprojx')
+    os.makedirs(os.path.dirname(base_project), exist_ok=True)
+    generate_project(base_project, params['targets'], params['groups'],
+                     params['files_per_group'], params['include_paths'])
+    source_root = os.path.join(workdir, 'SDK')
+    generate_source_tree(source_root, params['dirs'], params['files_per_dir'])
+    project_dir = os.path.dirname(base_project)
+
+    def fresh_project(name):
+        path = os.path.join(project_dir, name + '.uvprojx')
+        shutil.copyfile(base_project, path)
+        return path
+
+    def populated_project(name, recursive=False):
+        path = fresh_project(name)
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            manager = KeilProjectManager(path)
+            manager.add_folder(source_root, recursive=recursive)
+            manager.save()
+        return path
+
+    results = []
+
+    def record(operation, func):
+        seconds, peak_kb, counts, counters = measure(func, memory)
+        results.append({
+            'size': size_name,
+            'backend': backend,
+            'operation': operation,
+            'seconds': round(seconds, 6),
+            'peak_kb': peak_kb,
+            'counts': counts,
+            # 运行统计的计数器：dirs_visited、xml_searches、bytes_written等
+            'counters': counters,
+        })
+
+    if 'add' in operations:
+        def op_add(stats):
+            manager = KeilProjectManager(fresh_project('add'), stats=stats)
+            added = manager.add_folder(source_root)
+            return {'files_added': added}
+        record('add', op_add)
+
+    if 'add-recursive' in operations:
+        def op_add_recursive(stats):
+            manager = KeilProjectManager(fresh_project('add_recursive'), stats=stats)
+            added = manager.add_folder(source_root, recursive=True)
+            return {'files_added': added}
+        record('add-recursive', op_add_recursive)
+
+    if 'delete' in operations:
+        delete_source = populated_project('delete_source')
+
+        def op_delete(stats):
+            shutil.copyfile(delete_source, os.path.join(project_dir, 'delete.uvprojx'))
+            manager = KeilProjectManager(os.path.join(project_dir, 'delete.uvprojx'), stats=stats)
+            removed, _ = manager.delete_folder(source_root)
+            return {'files_removed': removed}
+        record('delete', op_delete)
+
+    if 'delete-group' in operations:
+        def op_delete_group(stats):
+            manager = KeilProjectManager(fresh_project('delete_group'), stats=stats)
+            removed = 0
+            for g in range(0, params['groups'], 2):
+                if manager.remove_group_by_name(f'Existing{g}'):
+                    removed += 1
+            return {'groups_removed': removed}
+        record('delete-group', op_delete_group)
+
+    if 'list' in operations:
+        # 纯流式解析路径，不读取也不写入快照；列出不经过KeilProjectManager，没有计数器
+        list_source = populated_project('list')
+        record('list', lambda stats: {'exit_code': stream_project_listing(list_source, use_snapshot=False)})
+
+    if 'list-snapshot' in operations:
+        # 快照路径：先建立快照，只测量从有效快照读取的耗时
+        snapshot_source = populated_project('list_snapshot')
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            stream_project_listing(snapshot_source)
+        record('list-snapshot', lambda stats: {'exit_code': stream_project_listing(snapshot_source)})
+
+    if 'save' in operations:
+        save_source = populated_project('save_source')
+
+        def op_save(stats):
+            path = os.path.join(project_dir, 'save.uvprojx')
+            shutil.copyfile(save_source, path)
+            manager = KeilProjectManager(path, stats=stats)
+            # 清空磁盘上的文件并强制写入，测量完整的序列化和写盘开销（内容相同时save会跳过写入）
+            open(path, 'wb').close()
+            manager.modified = True
+            manager.original_data = b''
+            manager.save()
+            return {'bytes_written': os.path.getsize(path)}
+        record('save', op_save)
+
+    return results
+
+
+def print_table(results):
+    """以表格形式打印结果"""
+    print(f"{'规模':<8} {'后端':<6} {'操作':<14} {'耗时(s)':>10} {'峰值内存(KB)':>14}  计数")
+    for r in results:
+        peak = '-' if r['peak_kb'] is None else str(r['peak_kb'])
+        counts = ', '.join(f"{k}={v}" for k, v in (r['counts'] or {}).items())
+        print(f"{r['size']:<8} {r['backend']:<6} {r['operation']:<14} {r['seconds']:>10.4f} {peak:>14}  {counts}")
+
+
+def print_backend_comparison(results):
+    """对比各后端相对标准库后端的耗时"""
+    etree = {(r['size'], r['operation']): r['seconds'] for r in results if r['backend'] == 'etree'}
+    rows = [r for r in results if r['backend'] != 'etree' and etree.get((r['size'], r['operation']))]
+    if not rows:
+        return
+    print(f"\n{'规模':<8} {'后端':<6} {'操作':<14} {'相对etree':>10}")
+    for r in rows:
+        ratio = r['seconds'] / etree[(r['size'], r['operation'])]
+        print(f"{r['size']:<8} {r['backend']:<6} {r['operation']:<14} {ratio:>9.2f}x")
+
+
+def compare_with_baseline(results, baseline_file, tolerance):
+    """与基准结果比较，返回超出容差的回归列表"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        # 旧的基准结果没有后端字段，视为标准库后端
+        baseline = {(r['size'], r.get('backend', 'etree'), r['operation']): r for r in json.load(f)['results']}
+    regressions = []
+    for r in results:
+        base = baseline.get((r['size'], r['backend'], r['operation']))
+        if base and base['seconds'] > 0 and r['seconds'] > base['seconds'] * tolerance:
+            regressions.append((r['size'], r['backend'], r['operation'], base['seconds'], r['seconds']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keil项目文件助手性能基准 - 生成合成工程和源码树并测量各操作耗时')
+    parser.add_argument('-s', '--sizes', default='small,medium',
+                        help=f"要运行的规模，逗号分隔(可选: {', '.join(SIZES)})")
+    parser.add_argument('-o', '--operations', default=','.join(OPERATIONS),
+                        help=f"要运行的操作，逗号分隔(可选: {', '.join(OPERATIONS)})")
+    parser.add_argument('-b', '--backends', default='etree,lxml' if lxml_etree is not None else 'etree',
+                        help='要对比的XML后端，逗号分隔(可选: etree, lxml；默认在安装了lxml时两者都运行)')
+    parser.add_argument('--json', help='将结果以JSON写入文件(使用-表示标准输出)')
+    parser.add_argument('--no-memory', action='store_true', help='不测量峰值内存(跳过tracemalloc运行)')
+    parser.add_argument('--baseline', help='基准结果JSON文件，用于检测性能回归')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='相对基准允许的最大耗时倍数(默认1.5)')
+    parser.add_argument('--keep', action='store_true', help='保留生成的临时文件')
+    args = parser.parse_args()
+
+    sizes = [s.strip() for s in args.sizes.split(',') if s.strip()]
+    operations = [o.strip() for o in args.operations.split(',') if o.strip()]
+    for size in sizes:
+        if size not in SIZES:
+            print(f"错误：未知规模 '{size}'")
+            sys.exit(1)
+    for operation in operations:
+        if operation not in OPERATIONS:
+            print(f"错误：未知操作 '{operation}'")
+            sys.exit(1)
+    backends = [b.strip() for b in args.backends.split(',') if b.strip()]
+    for backend in backends:
+        if backend not in ('etree', 'lxml'):
+            print(f"错误：未知XML后端 '{backend}'")
+            sys.exit(1)
+        if backend == 'lxml' and lxml_etree is None:
+            print("错误：lxml后端需要先安装lxml(pip install lxml)")
+            sys.exit(1)
+
+    results = []
+    for size in sizes:
+        for backend in backends:
+            workdir = tempfile.mkdtemp(prefix=f'keil_bench_{size}_{backend}_')
+            try:
+                results.extend(run_size(size, SIZES[size], workdir, operations, not args.no_memory, backend))
+            finally:
+                if args.keep:
+                    print(f"信息：保留临时文件 {workdir}")
+                else:
+                    shutil.rmtree(workdir, ignore_errors=True)
+
+    document = {
+        'python': sys.version.split()[0],
+        'sizes': {s: SIZES[s] for s in sizes},
+        'backends': backends,
+        'results': results,
+    }
+    if args.json == '-':
+        json.dump(document, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_table(results)
+        print_backend_comparison(results)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(document, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        for size, backend, operation, before, after in regressions:
+            print(f"回归: {size} {backend} {operation} {before:.4f}s -> {after:.4f}s")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,1481 @@
 import os
+import json
+import hashlib
+import re
+import shutil
+import tempfile
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 import xml.etree.ElementTree as ET
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # 未安装lxml时使用标准库后端
+    lxml_etree = None
 from pathlib import Path
 import argparse
 import sys
+import io
+import glob
+import fnmatch
+import select
+import struct
+import ctypes
+import ctypes.util
+import time
+import functools
+import traceback
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from itertools import repeat
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+def normalize_path_key(path):
+    """生成用于比较的标准化路径键（忽略大小写和路径分隔符差异）"""
+    return path.lower().replace('\\', '/').rstrip('/')
+
+
+# Keil的FileType代码与查询时使用的类型名称
+FILE_TYPE_NAMES = {'1': 'c', '2': 'asm', '3': 'obj', '4': 'lib', '5': 'text', '8': 'cpp'}
+
+
+def file_record(target_name, group_name, file_name, file_path, file_type):
+    """构造查询输出中的文件记录"""
+    return {'kind': 'file', 'target': target_name, 'group': group_name, 'name': file_name,
+            'path': file_path, 'file_type': FILE_TYPE_NAMES.get(file_type, file_type)}
+
+
+def match_file_type(file_type, wanted):
+    """文件类型是否匹配，wanted可为类型代码('1')或名称('c')"""
+    return wanted is None or file_type == wanted or FILE_TYPE_NAMES.get(file_type) == wanted
+
+
+def match_targets(target_name, patterns):
+    """Target名称是否匹配任一通配符，patterns为空时全部匹配"""
+    return not patterns or any(fnmatch.fnmatchcase(target_name or '', p) for p in patterns)
+
+
+def match_path_pattern(file_path, pattern):
+    """文件路径是否匹配通配符（忽略大小写和路径分隔符差异）"""
+    return pattern is None or fnmatch.fnmatchcase(normalize_path_key(file_path), normalize_path_key(pattern))
+
+
+class RunStats:
+    """运行统计：记录各阶段耗时、调用次数和热点计数器
+
+    可作为KeilProjectManager的stats参数传入，以编程方式获取统计结果。
+    """
+    def __init__(self):
+        self.timings = defaultdict(float)
+        self.calls = Counter()
+        self.counters = Counter()
+
+    @contextmanager
+    def phase(self, name):
+        """统计代码块耗时，嵌套或重复进入时累加"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def timed_iter(self, name, iterable):
+        """统计迭代器每次取值的耗时（如目录遍历），不含使用方处理结果的时间"""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def as_dict(self):
+        return {
+            'timings': {name: round(seconds, 6) for name, seconds in self.timings.items()},
+            'calls': dict(self.calls),
+            'counters': dict(self.counters),
+        }
+
+    def format_table(self):
+        """格式化为文本表格"""
+        lines = ["\n阶段耗时:"]
+        for name, seconds in sorted(self.timings.items(), key=lambda item: -item[1]):
+            lines.append(f"  {name:<20} {seconds:>10.4f}s  ({self.calls[name]}次)")
+        if self.counters:
+            lines.append("\n计数器:")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"  {name:<20} {value:>10}")
+        return '\n'.join(lines)
+
+
+class NullStats:
+    """不记录任何信息的统计对象，未启用统计时使用以减少开销"""
+    def phase(self, name):
+        return nullcontext()
+
+    def count(self, name, n=1):
+        pass
+
+    def timed_iter(self, name, iterable):
+        return iterable
+
+
+def journaled(func):
+    """方法装饰器：记录对工程的顶层修改操作，合并保存时在磁盘上的最新版本上重放"""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self._journal_depth:
+            return func(self, *args, **kwargs)
+        self._journal_depth += 1
+        try:
+            result = func(self, *args, **kwargs)
+        finally:
+            self._journal_depth -= 1
+        self.journal.append((func.__name__, args, kwargs))
+        return result
+    return wrapper
+
+
+def timed(phase):
+    """方法装饰器：将方法耗时计入self.stats的指定阶段"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.stats.phase(phase):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class IgnoreMatcher:
+    """gitignore语义的忽略规则，一次编译为正则，按最后匹配的规则决定是否忽略
+
+    路径为相对于扫描根目录、以'/'分隔的路径。
+    """
+    def __init__(self, patterns=()):
+        self.patterns = []
+        rules = []
+        for line in patterns:
+            rule = self._compile_pattern(line)
+            if rule is not None:
+                self.patterns.append(line.strip())
+                rules.append(rule)
+        # 将相邻且类型相同的规则合并为一个正则，减少匹配次数
+        self.groups = []
+        for body, negate, dir_only in rules:
+            if self.groups and self.groups[-1][1:] == [negate, dir_only]:
+                self.groups[-1][0].append(body)
+            else:
+                self.groups.append([[body], negate, dir_only])
+        self.groups = [(re.compile('^(?:' + '|'.join(bodies) + ')$'), negate, dir_only)
+                       for bodies, negate, dir_only in self.groups]
+
+    def __bool__(self):
+        return bool(self.groups)
+
+    @staticmethod
+    def _compile_pattern(line):
+        """将单条gitignore规则转换为 (正则, 是否取反, 是否仅匹配目录)"""
+        pattern = line.rstrip('\r\n')
+        if not pattern.strip() or pattern.startswith('#'):
+            return None
+        pattern = pattern.rstrip(' ') if not pattern.endswith('\\ ') else pattern
+        negate = pattern.startswith('!')
+        if negate:
+            pattern = pattern[1:]
+        elif pattern.startswith('\\!') or pattern.startswith('\\#'):
+            pattern = pattern[1:]
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        if not pattern:
+            return None
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+        
+        body = ''
+        i = 0
+        while i < len(pattern):
+            c = pattern[i]
+            if pattern.startswith('**/', i):
+                body += '(?:.*/)?'
+                i += 3
+                continue
+            if pattern.startswith('/**', i) and i + 3 == len(pattern):
+                body += '/.*'
+                i += 3
+                continue
+            if pattern.startswith('**', i):
+                body += '.*'
+                i += 2
+                continue
+            if c == '*':
+                body += '[^/]*'
+            elif c == '?':
+                body += '[^/]'
+            elif c == '[':
+                end = pattern.find(']', i + 1)
+                if end == -1:
+                    body += re.escape(c)
+                else:
+                    content = pattern[i + 1:end]
+                    if content.startswith('!'):
+                        content = '^' + content[1:]
+                    body += '[' + content.replace('\\', '\\\\') + ']'
+                    i = end
+            elif c == '\\' and i + 1 < len(pattern):
+                i += 1
+                body += re.escape(pattern[i])
+            else:
+                body += re.escape(c)
+            i += 1
+        if not anchored:
+            body = '(?:.*/)?' + body
+        return body, negate, dir_only
+
+    def match(self, rel_path, is_dir=False):
+        """路径是否被忽略"""
+        for regex, negate, dir_only in reversed(self.groups):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                return not negate
+        return False
+
+    @classmethod
+    def for_folder(cls, folder_path, extra_patterns=()):
+        """读取文件夹下的.keilignore并合并额外规则"""
+        patterns = []
+        try:
+            with open(os.path.join(folder_path, '.keilignore'), 'r', encoding='utf-8') as f:
+                patterns.extend(f.read().splitlines())
+        except OSError:
+            pass
+        patterns.extend(extra_patterns or ())
+        return cls(patterns)
+
+
+def _join_rel(rel_dir, name):
+    return f"{rel_dir}/{name}" if rel_dir else name
+
+
+# 扫描结果：目录路径、该目录下的头文件、该目录下符合扩展名的全部文件（保持目录列举顺序）
+ScanBatch = namedtuple('ScanBatch', ['dirpath', 'headers', 'files'])
+
+
+def _scan_one_dir(dirpath, extensions, ignore=None, rel_dir=''):
+    """使用os.scandir列举单个目录，复用DirEntry的类型信息避免额外stat
+
+    ignore为IgnoreMatcher时，被忽略的文件和子目录不会产出，子目录也不会继续遍历。
+    """
+    subdirs = []
+    headers = []
+    files = []
+    try:
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    # 与os.walk一致：不进入符号链接目录
+                    try:
+                        if entry.is_symlink():
+                            continue
+                    except OSError:
+                        continue
+                    if ignore and ignore.match(_join_rel(rel_dir, entry.name), True):
+                        continue
+                    subdirs.append(entry.path)
+                    continue
+                name = entry.name
+                if name.endswith(extensions):
+                    if ignore and ignore.match(_join_rel(rel_dir, name)):
+                        continue
+                    files.append(name)
+                    if name.endswith(('.h', '.hpp')):
+                        headers.append(name)
+    except OSError:
+        return None
+    return ScanBatch(dirpath, headers, files), subdirs
+
+
+def scan_source_tree(folder_path, extensions, max_workers=None, ignore=None):
+    """并行扫描目录树，按与os.walk相同的先序顺序逐目录产出ScanBatch"""
+    top = os.fspath(folder_path)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = [(pool.submit(_scan_one_dir, top, extensions, ignore, ''), '')]
+        while pending:
+            future, rel_dir = pending.pop()
+            result = future.result()
+            if result is None:
+                continue
+            batch, subdirs = result
+            # 子目录提前并行列举，逆序压栈以保持先序遍历顺序
+            futures = []
+            for d in subdirs:
+                rel = _join_rel(rel_dir, os.path.basename(d))
+                futures.append((pool.submit(_scan_one_dir, d, extensions, ignore, rel), rel))
+            pending.extend(reversed(futures))
+            yield batch
+
+
+def _probe_dir(dirpath, extensions, previous, ignore=None, rel_dir='', force=False):
+    """检查目录mtime，未变化时复用清单记录，否则重新列举（force为True时总是重新列举）"""
+    try:
+        mtime = os.stat(dirpath).st_mtime_ns
+    except OSError:
+        return None
+    if not force and previous is not None and previous.get('mtime') == mtime:
+        return dirpath, previous, False
+    result = _scan_one_dir(dirpath, extensions, ignore, rel_dir)
+    if result is None:
+        return None
+    batch, subdirs = result
+    entry = {
+        'mtime': mtime,
+        'subdirs': [os.path.basename(d) for d in subdirs],
+        'headers': batch.headers,
+        'files': batch.files,
+    }
+    return dirpath, entry, True
+
+
+def scan_source_tree_incremental(folder_path, extensions, previous, max_workers=None, ignore=None, dirty=None):
+    """增量扫描目录树：只重新列举mtime变化或新出现的目录
+
+    dirty为已知发生变化的目录集合（如来自文件系统事件）时，只重新列举这些目录和新出现的目录，
+    其余目录直接复用上次的记录而不再检查mtime。
+    返回 (目录状态, 需要处理的目录列表)，目录列表按先序遍历顺序排列。
+    """
+    top = os.fspath(folder_path)
+    state = {}
+    changed = []
+    
+    def probe(pool, d, rel):
+        prev = previous.get(d)
+        if dirty is not None and prev is not None and d not in dirty:
+            return pool.submit(lambda: (d, prev, False))
+        return pool.submit(_probe_dir, d, extensions, prev, ignore, rel, dirty is not None)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = [(probe(pool, top, ''), '')]
+        while pending:
+            future, rel_dir = pending.pop()
+            result = future.result()
+            if result is None:
+                continue
+            dirpath, entry, rescanned = result
+            state[dirpath] = entry
+            if rescanned:
+                changed.append(dirpath)
+            futures = []
+            for name in entry['subdirs']:
+                d = os.path.join(dirpath, name)
+                rel = _join_rel(rel_dir, name)
+                futures.append((probe(pool, d, rel), rel))
+            pending.extend(reversed(futures))
+    return state, changed
+
+
+INCLUDE_PATTERN = re.compile(rb'^[ \t]*#[ \t]*include[ \t]*([<"])([^>"\r\n]+)[>"]', re.MULTILINE)
+INCLUDE_SCAN_EXTENSIONS = ('.c', '.cpp', '.h', '.hpp', '.s', '.asm')
+
+
+def parse_includes(file_path):
+    """读取文件中的#include指令，返回 [(包含的文件名, 是否为引号形式)]"""
+    try:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return []
+    return [(m.group(2).decode('utf-8', errors='replace').strip().replace('\\', '/'), m.group(1) == b'"')
+            for m in INCLUDE_PATTERN.finditer(data)]
+
+
+class IncludeCache:
+    """#include解析结果的缓存，按文件mtime和大小判断是否失效，保存在工程文件旁"""
+    VERSION = 1
+
+    def __init__(self, project_file):
+        self.path = project_file + '.includes.json'
+        self.entries = {}
+        self.changed = False
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == self.VERSION:
+            self.entries = data.get('files', {})
+
+    def save(self):
+        if not self.changed:
+            return
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'files': self.entries}, f, ensure_ascii=False)
+        self.changed = False
+
+    def get_includes(self, file_path):
+        """返回文件的#include列表，缓存失效时重新解析"""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return []
+        entry = self.entries.get(file_path)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return [tuple(item) for item in entry[2]]
+        includes = parse_includes(file_path)
+        self.entries[file_path] = [st.st_mtime_ns, st.st_size, includes]
+        self.changed = True
+        return includes
+
+
+# Target映射条目：Target节点、名称、Groups节点（可能为None）、Include路径索引、是否被-t/--target选中
+TargetInfo = namedtuple('TargetInfo', ['node', 'name', 'groups_node', 'include_index', 'selected'])
+
+# Include分析结果：需要的Include目录（按选择顺序）、未解析的#include、可达头文件集合
+IncludeAnalysis = namedtuple('IncludeAnalysis', ['include_dirs', 'unresolved', 'reachable_headers'])
+
+
+class IncludeAnalyzer:
+    """分析源文件的#include依赖，计算扫描文件夹中最少需要的Include目录
+
+    headers为扫描得到的头文件绝对路径（按遍历顺序），existing_dirs为项目中已有的Include目录。
+    文件名比较忽略大小写和路径分隔符差异，与Keil在Windows上的行为一致。
+    """
+    def __init__(self, headers, existing_dirs=(), cache=None, max_workers=None):
+        self.cache = cache
+        self.max_workers = max_workers
+        # 文件夹内头文件索引：标准化路径 -> 原始路径，以及 文件名 -> [标准化路径]
+        self.headers = {}
+        self.by_name = defaultdict(list)
+        for path in headers:
+            key = normalize_path_key(path)
+            if key not in self.headers:
+                self.headers[key] = path
+                self.by_name[key.rsplit('/', 1)[-1]].append(key)
+        self.existing_keys = {normalize_path_key(d) for d in existing_dirs}
+        self.existing_dirs = [d for d in existing_dirs]
+        self._dir_listings = {}
+        self._existing_resolved = {}
+
+    def _read_includes(self, files):
+        """并行读取文件的#include（优先使用缓存）"""
+        reader = self.cache.get_includes if self.cache is not None else parse_includes
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return dict(zip(files, pool.map(reader, files)))
+
+    def _list_dir(self, dirpath):
+        """列举目录，返回小写名称集合（每个目录只列举一次）"""
+        listing = self._dir_listings.get(dirpath)
+        if listing is None:
+            try:
+                listing = {entry.lower() for entry in os.listdir(dirpath)}
+            except OSError:
+                listing = set()
+            self._dir_listings[dirpath] = listing
+        return listing
+
+    def _exists_in_dir(self, dirpath, name):
+        """目录下是否存在该文件（忽略大小写）"""
+        name = name.replace('\\', '/')
+        first = name.split('/', 1)[0].lower()
+        return first in self._list_dir(dirpath) and ('/' not in name or os.path.isfile(os.path.join(dirpath, name)))
+
+    def _in_existing_dir(self, name):
+        """文件夹外的已有Include目录中是否能找到该文件"""
+        result = self._existing_resolved.get(name)
+        if result is None:
+            result = any(self._exists_in_dir(d, name) for d in self.existing_dirs)
+            self._existing_resolved[name] = result
+        return result
+
+    def analyze(self, sources):
+        """从源文件出发遍历包含关系，返回IncludeAnalysis"""
+        requirements = {}
+        unresolved = []
+        visited = set()
+        queue = [os.path.abspath(s) for s in sources]
+        while queue:
+            batch = [f for f in dict.fromkeys(queue) if normalize_path_key(f) not in visited]
+            queue = []
+            visited.update(normalize_path_key(f) for f in batch)
+            for file_path, includes in self._read_includes(batch).items():
+                for name, quoted in includes:
+                    name_key = normalize_path_key(name)
+                    # 引号形式先相对于当前文件所在目录查找
+                    if quoted:
+                        local_key = normalize_path_key(os.path.normpath(os.path.join(os.path.dirname(file_path), name)))
+                        if local_key in self.headers:
+                            queue.append(self.headers[local_key])
+                            continue
+                    # 在文件夹内的头文件中查找可用的Include目录
+                    candidates = {}
+                    suffix = '/' + name_key
+                    for key in self.by_name.get(name_key.rsplit('/', 1)[-1], ()):
+                        if key.endswith(suffix):
+                            candidates[key[:-len(suffix)]] = key
+                    if candidates:
+                        satisfied = [d for d in candidates if d in self.existing_keys]
+                        if satisfied:
+                            queue.append(self.headers[candidates[satisfied[0]]])
+                            continue
+                        requirements.setdefault(frozenset(candidates), name)
+                        queue.extend(self.headers[key] for key in candidates.values())
+                        continue
+                    # 引号形式还可能是当前目录下未被扫描的文件（如.inc），按实际目录内容判断
+                    if quoted and self._exists_in_dir(os.path.dirname(file_path), name):
+                        continue
+                    if not self._in_existing_dir(name):
+                        unresolved.append((file_path, name))
+        
+        include_dirs = self._select_dirs(list(requirements))
+        reachable = {self.headers[key] for key in visited if key in self.headers}
+        return IncludeAnalysis(include_dirs, unresolved, reachable)
+
+    def _select_dirs(self, requirements):
+        """贪心集合覆盖：每次选择能满足最多未满足需求的目录"""
+        order = {}
+        for key in self.headers:
+            order.setdefault(key.rsplit('/', 1)[0], len(order))
+        selected = []
+        pending = requirements
+        while pending:
+            counts = Counter(d for req in pending for d in req)
+            best = min(counts, key=lambda d: (-counts[d], order.get(d, len(order)), d))
+            selected.append(best)
+            pending = [req for req in pending if best not in req]
+        # 还原为原始大小写的目录路径
+        originals = {}
+        for key, path in self.headers.items():
+            originals.setdefault(key.rsplit('/', 1)[0], os.path.dirname(path))
+        return [originals.get(d, d) for d in selected]
+
+
+class InotifyWatcher:
+    """基于Linux inotify的目录监视器，通过ctypes调用libc，无需第三方依赖"""
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify仅支持Linux")
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1失败")
+        self.paths = {}
+        self.wds = {}
+
+    def watch(self, path):
+        if path in self.wds:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"无法监视目录 {path}")
+        self.paths[wd] = path
+        self.wds[path] = wd
+
+    def unwatch(self, path):
+        wd = self.wds.pop(path, None)
+        if wd is not None:
+            self.paths.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def wait(self, timeout=None):
+        """等待事件，返回发生变化的目录集合（超时返回空集合，事件队列溢出返回None）"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        dirty = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size + length
+                if mask & self.IN_Q_OVERFLOW:
+                    return None
+                path = self.paths.get(wd)
+                if path is None:
+                    continue
+                if mask & self.IN_IGNORED:
+                    self.paths.pop(wd, None)
+                    self.wds.pop(path, None)
+                    continue
+                dirty.add(path)
+                if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                    dirty.add(os.path.dirname(path))
+        return dirty
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """轮询监视器：inotify不可用时使用，每个周期通过目录mtime检查变化"""
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.mtimes = {}
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def watch(self, path):
+        self.mtimes[path] = self._mtime(path)
+
+    def unwatch(self, path):
+        self.mtimes.pop(path, None)
+
+    def wait(self, timeout=None):
+        """等待一个轮询周期（去抖阶段为timeout秒），返回自上次检查以来mtime发生变化的目录集合"""
+        time.sleep(self.interval if timeout is None else timeout)
+        dirty = set()
+        for path, mtime in self.mtimes.items():
+            current = self._mtime(path)
+            if current != mtime:
+                self.mtimes[path] = current
+                dirty.add(path)
+        return dirty
+
+    def close(self):
+        pass
+
+
+class DirectoryListing:
+    """按目录缓存的存在性检查：每个目录只列出一次，之后的检查在内存中完成（忽略大小写，与Keil一致）"""
+    def __init__(self, stats=None):
+        self.stats = stats if stats is not None else NullStats()
+        self.entries = {}
+
+    def _list(self, dirpath):
+        """列出目录，返回 小写名称 -> 是否为目录；目录不存在时返回空字典"""
+        entries = self.entries.get(dirpath)
+        if entries is None:
+            entries = {}
+            self.stats.count('dirs_listed')
+            try:
+                with os.scandir(dirpath) as it:
+                    for entry in it:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        entries[entry.name.lower()] = entries.get(entry.name.lower(), False) or is_dir
+            except OSError:
+                pass
+            self.entries[dirpath] = entries
+        return entries
+
+    def lookup(self, path):
+        """返回路径是否存在及是否为目录：None表示不存在，否则为is_dir"""
+        parent, name = os.path.split(os.path.normpath(path))
+        if not name:
+            return True if os.path.isdir(parent) else None
+        return self._list(parent).get(name.lower())
+
+    def exists(self, path):
+        return self.lookup(path) is not None
+
+    def is_dir(self, path):
+        return self.lookup(path) is True
+
+
+# 序列化结果中的空元素标签：<a/>、<a />或带属性的<a b="c"/>（属性值和文本中的'>'已被转义），
+# 注释、CDATA和处理指令整体匹配后原样保留
+_EMPTY_ELEMENT_RE = re.compile(r'(<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>)|<([^\s<>!?/]+)([^<>]*?)\s*/>', re.S)
+
+
+def format_empty_elements(text, short_empty_elements=True, empty_element_space=True):
+    """统一空元素的写法：short_empty_elements为False时写作<a></a>，否则按empty_element_space写作<a />或<a/>"""
+    def replace(match):
+        if match.group(1):
+            return match.group(1)
+        tag, attrs = match.group(2), match.group(3)
+        if not short_empty_elements:
+            return f'<{tag}{attrs}></{tag}>'
+        return f'<{tag}{attrs} />' if empty_element_space else f'<{tag}{attrs}/>'
+    return _EMPTY_ELEMENT_RE.sub(replace, text)
+
+
+class EtreeBackend:
+    """标准库xml.etree.ElementTree后端"""
+    name = 'etree'
+    SubElement = staticmethod(ET.SubElement)
+    ElementTree = staticmethod(ET.ElementTree)
+
+    def parse(self, data):
+        # 保留注释，避免保存时丢失
+        parser = ET.XMLParser(target=ET.TreeBuilder(insert_comments=True))
+        parser.feed(data)
+        return parser.close()
+
+    def tostring(self, root, short_empty_elements=True, empty_element_space=True):
+        text = ET.tostring(root, encoding='unicode', short_empty_elements=short_empty_elements)
+        # 标准库总是输出<a />
+        if short_empty_elements and not empty_element_space:
+            text = format_empty_elements(text, empty_element_space=False)
+        return text
+
+    def iterparse(self, source, events):
+        return ET.iterparse(source, events=events)
+
+    def find(self, elem, path):
+        return elem.find(path)
+
+    def findall(self, elem, path):
+        return elem.findall(path)
+
+
+class LxmlBackend:
+    """lxml后端：后代搜索使用预编译的XPath，输出与标准库后端一致（需显式选择）"""
+    name = 'lxml'
+
+    def __init__(self):
+        self.SubElement = lxml_etree.SubElement
+        self.ElementTree = lxml_etree.ElementTree
+        self.parser = lxml_etree.XMLParser(remove_blank_text=False, remove_comments=False,
+                                           resolve_entities=False, huge_tree=True)
+        self.xpaths = {}
+
+    def parse(self, data):
+        return lxml_etree.fromstring(data, self.parser)
+
+    def tostring(self, root, short_empty_elements=True, empty_element_space=True):
+        text = lxml_etree.tostring(root, encoding='unicode')
+        # lxml总是输出<a/>，在序列化结果上改写，不修改树本身
+        if not short_empty_elements or empty_element_space:
+            text = format_empty_elements(text, short_empty_elements, empty_element_space)
+        return text
+
+    def iterparse(self, source, events):
+        # 流式读取时每个元素都要创建lxml代理对象，标准库的iterparse反而更快
+        return ET.iterparse(source, events=events)
+
+    def _xpath(self, path):
+        xpath = self.xpaths.get(path)
+        if xpath is None:
+            xpath = lxml_etree.XPath(path)
+            self.xpaths[path] = xpath
+        return xpath
+
+    def find(self, elem, path):
+        # XPath会求出全部匹配结果，只取第一个时lxml的find在找到后即停止
+        return elem.find(path)
+
+    def findall(self, elem, path):
+        return self._xpath(path)(elem)
+
+
+XML_BACKENDS = ('auto', 'etree', 'lxml')
+XML_PARSE_ERRORS = (ET.ParseError,) if lxml_etree is None else (ET.ParseError, lxml_etree.XMLSyntaxError)
+_xml_backends = {}
+_default_xml_backend = 'auto'
+
+
+def select_xml_backend(name):
+    """设置默认的XML后端名称(auto、etree或lxml)"""
+    global _default_xml_backend
+    get_xml_backend(name)
+    _default_xml_backend = name
+
+
+def get_xml_backend(name=None):
+    """获取XML后端实例：auto使用标准库（基准测试中lxml的添加和保存更慢），lxml需显式指定"""
+    name = name or _default_xml_backend
+    if name == 'auto':
+        name = 'etree'
+    if name not in ('etree', 'lxml'):
+        raise ValueError(f"未知的XML后端 '{name}'，可用后端: {', '.join(XML_BACKENDS)}")
+    backend = _xml_backends.get(name)
+    if backend is None:
+        if name == 'lxml':
+            if lxml_etree is None:
+                raise ValueError("使用lxml后端需要先安装lxml(pip install lxml)")
+            backend = LxmlBackend()
+        else:
+            backend = EtreeBackend()
+        _xml_backends[name] = backend
+    return backend
+
+
+def hash_data(data):
+    """计算数据的SHA-256"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """分块计算文件的SHA-256，不把整个文件读入内存"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class HashingReader:
+    """在读取的同时计算SHA-256的文件包装，流式解析时顺带得到文件哈希"""
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.sha.update(data)
+        return data
+
+    def hexdigest(self):
+        """读取剩余内容后返回整个文件的哈希"""
+        while self.read(1 << 20):
+            pass
+        return self.sha.hexdigest()
+
+
+def remove_element(parent, elem):
+    """移除子元素，若其为最后一个子元素则把它的尾部空白交给新的最后一个元素以保持缩进"""
+    if parent[-1] is elem:
+        if len(parent) > 1:
+            parent[-2].tail = elem.tail
+        elif not (parent.text or '').strip():
+            parent.text = elem.tail
+    parent.remove(elem)
+
+
+def indent_new_elements(elem, unit, level=0):
+    """只为新建元素（尾部空白为None）补充缩进，保留原有元素的空白不变"""
+    children = list(elem)
+    if not children:
+        return
+    inner = '\n' + unit * (level + 1)
+    outer = '\n' + unit * level
+    if elem.text is None:
+        elem.text = inner
+    for i, child in enumerate(children):
+        if child.tail is None:
+            # 原来的最后一个子元素不再是最后一个，改为同级缩进
+            if i > 0 and children[i - 1].tail == outer:
+                children[i - 1].tail = inner
+            child.tail = outer if i == len(children) - 1 else inner
+        indent_new_elements(child, unit, level + 1)
+
+
+class ProjectLock:
+    """工程文件的建议锁（<工程>.lock），协调多个进程对同一工程的加载和保存
+
+    锁加在单独的锁文件上，工程文件被原子替换后锁依然有效；无法创建锁文件时(如只读目录)不加锁。
+    """
+    def __init__(self, project_file, timeout=60.0):
+        self.path = project_file + '.lock'
+        self.timeout = timeout
+        self.file = None
+
+    def _try_lock(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def __enter__(self):
+        try:
+            self.file = open(self.path, 'a+b')
+        except OSError:
+            self.file = None
+            return self
+        deadline = time.monotonic() + self.timeout
+        while not self._try_lock():
+            if time.monotonic() >= deadline:
+                self.file.close()
+                self.file = None
+                raise TimeoutError(f"等待工程锁 {self.path} 超时({self.timeout}秒)")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        if self.file is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.file.close()
+            self.file = None
+
+
+class ScanManifest:
+    """增量扫描清单，保存在工程文件旁，记录目录mtime、文件列表和工程文件哈希"""
+    VERSION = 1
 
-class KeilProjectManager:
     def __init__(self, project_file):
+        self.path = project_file + '.scan.json'
+        self.project_hash = None
+        self.scans = {}
+
+    def load(self):
+        """读取清单，不存在或格式不符时视为空清单"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != self.VERSION:
+            return
+        self.project_hash = data.get('project_hash')
+        self.scans = data.get('scans', {})
+
+    def get_scan(self, key, project_hash):
+        """获取扫描记录，工程文件被外部修改过时返回空记录"""
+        if project_hash != self.project_hash:
+            return {}
+        return self.scans.get(key, {})
+
+    def save(self, project_hash):
+        """写入清单"""
+        self.project_hash = project_hash
+        data = {'version': self.VERSION, 'project_hash': project_hash, 'scans': self.scans}
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+
+class ProjectSnapshot:
+    """只读命令使用的工程快照，保存在工程文件旁，按工程文件大小、mtime和哈希判断是否失效"""
+    VERSION = 2
+
+    def __init__(self, project_file):
+        self.project_file = project_file
+        self.path = project_file + '.snapshot.json'
+
+    def load(self):
+        """返回快照中的工程条目，快照不存在或已失效时返回None"""
+        try:
+            st = os.stat(self.project_file)
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != self.VERSION or data.get('size') != st.st_size:
+            return None
+        if data.get('mtime_ns') != st.st_mtime_ns:
+            # mtime变化但内容可能未变（如检出、touch），按哈希确认后沿用快照
+            if hash_file(self.project_file) != data.get('hash'):
+                return None
+            data['mtime_ns'] = st.st_mtime_ns
+            self._write(data)
+        return data.get('items')
+
+    def record(self, project_file):
+        """流式解析工程文件并透传条目，同时把条目增量写入临时快照
+
+        解析时顺带计算工程文件哈希；全部条目产出完毕且工程文件在此期间未被修改时快照才生效。
+        """
+        st = os.stat(project_file)
+        out = tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(self.path) + '.', suffix='.tmp',
+                                            dir=os.path.dirname(self.path))
+            out = os.fdopen(fd, 'w', encoding='utf-8')
+        except OSError:
+            # 快照只是缓存，目录不可写时只做流式解析
+            pass
+        committed = False
+        try:
+            with open(project_file, 'rb') as f:
+                reader = HashingReader(f)
+                out = self._write_part(out, '{"version":%d,"size":%d,"mtime_ns":%d,"items":['
+                                       % (self.VERSION, st.st_size, st.st_mtime_ns))
+                for i, item in enumerate(iter_project_items(reader)):
+                    out = self._write_part(out, (',' if i else '')
+                                           + json.dumps(item, ensure_ascii=False, separators=(',', ':')))
+                    yield item
+                out = self._write_part(out, '],"hash":%s}' % json.dumps(reader.hexdigest()))
+            if out is not None:
+                committed = self._commit(out, tmp_path, project_file, st)
+                out = None
+        finally:
+            if out is not None:
+                out.close()
+            if tmp_path is not None and not committed:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _write_part(out, text):
+        """写入快照片段，写入失败（如磁盘已满）时放弃快照并返回None"""
+        if out is None:
+            return None
+        try:
+            out.write(text)
+            return out
+        except OSError:
+            out.close()
+            return None
+
+    def _commit(self, out, tmp_path, project_file, st):
+        """关闭临时快照，工程文件在解析期间未被修改时替换为正式快照，返回是否生效"""
+        try:
+            out.close()
+            now = os.stat(project_file)
+            if (now.st_size, now.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+                return False
+            os.replace(tmp_path, self.path)
+            return True
+        except OSError:
+            return False
+
+    def _write(self, data):
+        # 快照只是缓存，目录不可写时静默跳过
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(self.path) + '.', suffix='.tmp',
+                                            dir=os.path.dirname(self.path))
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+
+class PathResolver:
+    """计算相对于工程目录的Keil路径：按目录缓存相对路径，文件只需拼接文件名，并同时给出标准化键"""
+    def __init__(self, project_dir):
+        self.project_dir = project_dir
+        self.dirs = {}
+
+    def _relative_dir(self, dirpath):
+        rel_dir = self.dirs.get(dirpath)
+        if rel_dir is None:
+            rel_dir = os.path.relpath(os.path.abspath(dirpath), self.project_dir)
+            self.dirs[dirpath] = rel_dir
+        return rel_dir
+
+    def resolve(self, path):
+        """返回 (Keil相对路径, 标准化键)"""
+        dirpath, name = os.path.split(path)
+        if name in ('', '.', '..'):
+            rel_path = self._relative_dir(path)
+        else:
+            rel_dir = self._relative_dir(dirpath)
+            rel_path = name if rel_dir == '.' else os.path.join(rel_dir, name)
+        # 根据Keil的路径规则处理，如果路径不是以..开头，则添加./
+        if not rel_path.startswith('..') and not rel_path.startswith('./'):
+            rel_path = './' + rel_path
+        return rel_path, normalize_path_key(rel_path)
+
+
+class IncludePathIndex:
+    """单个Target的Include路径索引：有序路径表 + 每个路径的标准化键，仅在保存时写回XML"""
+    def __init__(self, node):
+        self.node = node
+        self.paths = []
+        self.path_keys = []
+        self.keys = set()
+        self.dirty = False
+        if node is not None and node.text:
+            for p in node.text.split(';'):
+                p = p.strip()
+                if p:
+                    self.paths.append(p)
+                    self.path_keys.append(normalize_path_key(p))
+            self.keys = set(self.path_keys)
+
+    def __contains__(self, rel_path):
+        return normalize_path_key(rel_path) in self.keys
+
+    def add(self, rel_path, key=None):
+        """添加路径（key为已计算好的标准化键），已存在时返回False"""
+        if key is None:
+            key = normalize_path_key(rel_path)
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        self.paths.append(rel_path)
+        self.path_keys.append(key)
+        self.dirty = True
+        return True
+
+    def remove(self, rel_path, include_subdirs=False, key=None):
+        """移除路径（可选同时移除其子目录），返回被移除的原始路径列表"""
+        if key is None:
+            key = normalize_path_key(rel_path)
+        if not include_subdirs and key not in self.keys:
+            return []
+        prefix = key + '/'
+        return self.filter_paths(lambda p, k: not (k == key or (include_subdirs and k.startswith(prefix))))
+
+    def retain(self, keep):
+        """只保留keep(path)为True的路径，返回被移除的原始路径列表"""
+        return self.filter_paths(lambda p, k: keep(p))
+
+    def filter_paths(self, keep):
+        """按keep(路径, 键)过滤路径表，返回被移除的原始路径列表"""
+        kept = []
+        kept_keys = []
+        removed = []
+        for p, k in zip(self.paths, self.path_keys):
+            if keep(p, k):
+                kept.append(p)
+                kept_keys.append(k)
+            else:
+                removed.append(p)
+        if removed:
+            self.paths = kept
+            self.path_keys = kept_keys
+            self.keys = set(kept_keys)
+            self.dirty = True
+        return removed
+
+    def flush(self):
+        """将索引内容写回XML节点"""
+        if self.dirty and self.node is not None:
+            self.node.text = ';'.join(self.paths)
+            self.dirty = False
+
+
+class KeilProjectManager:
+    def __init__(self, project_file, verbose=False, jobs=None, exclude=None, stats=None, analyze_includes=False,
+                 reachable_headers_only=False, dry_run=False, merge_on_save=False, lock_timeout=60.0, data=None,
+                 xml_backend=None, target_patterns=None):
+        # 合并保存时用相同的选项重新加载工程
+        self._options = dict(verbose=verbose, jobs=jobs, exclude=exclude, stats=stats, analyze_includes=analyze_includes,
+                             reachable_headers_only=reachable_headers_only, dry_run=dry_run,
+                             merge_on_save=merge_on_save, lock_timeout=lock_timeout, xml_backend=xml_backend,
+                             target_patterns=target_patterns)
         self.project_file = os.path.abspath(project_file)
         self.project_dir = os.path.dirname(self.project_file)
+        self.verbose = verbose
+        self.jobs = jobs
+        self.exclude = list(exclude or [])
+        self.stats = stats if stats is not None else NullStats()
+        self.analyze_includes = analyze_includes
+        self.reachable_headers_only = reachable_headers_only
+        # 只对名称匹配这些通配符的Target执行操作，为空时操作所有Target
+        self.target_patterns = list(target_patterns or [])
+        # 试运行时只在内存中修改，不写入工程文件、扫描清单、Include缓存和锁文件
+        self.dry_run = dry_run
+        # 保存时若工程文件已被其他进程修改，在最新版本上重放本次的操作
+        self.merge_on_save = merge_on_save
+        self.lock_timeout = lock_timeout
+        self.journal = []
+        self._journal_depth = 0
+        self._ignore_matchers = {}
+        self.path_resolver = PathResolver(self.project_dir)
+        self.xml = get_xml_backend(xml_backend)
         try:
-            self.tree = ET.parse(project_file)
-            self.root = self.tree.getroot()
+            with self.stats.phase('parse'):
+                if data is None:
+                    # 保存是原子替换，试运行不加锁读取也不会读到写了一半的文件
+                    with nullcontext() if dry_run else ProjectLock(self.project_file, lock_timeout):
+                        with open(self.project_file, 'rb') as f:
+                            data = f.read()
+                self.original_data = data
+                self.root = self.xml.parse(self.original_data)
+                self.tree = self.xml.ElementTree(self.root)
+            self.stats.count('bytes_read', len(self.original_data))
         except Exception as e:
             print(f"错误：无法解析项目文件 {project_file}，原因：{str(e)}")
             sys.exit(1)
-        
+        self.modified = False
+        self._load_format()
+        self.manifest = None
+        with self.stats.phase('build_index'):
+            self._load_include_indexes()
+            self._load_file_index()
+            self._load_target_map()
+
+    def _load_format(self):
+        """记录原始文件的XML声明、换行、缩进和空元素风格，保存时沿用"""
+        text = self.original_data.decode('utf-8', errors='replace')
+        self.newline = '\r\n' if '\r\n' in text else '\n'
+        text = text.replace('\r\n', '\n')
+        match = re.search(r'<(?![?!])', text)
+        self.prolog = text[:match.start()] if match else ''
+        self.epilog = text[len(text.rstrip()):]
+        match = re.search(r'encoding=["\']([^"\']+)["\']', self.prolog)
+        self.encoding = match.group(1) if match else 'utf-8'
+        # 根据原文件缩进推断缩进单位，未格式化的文件不补充缩进
+        root_text = self.root.text or ''
+        self.indent_unit = root_text.rsplit('\n', 1)[1] if '\n' in root_text else None
+        self.short_empty_elements = text.count('/>') > text.count('></')
+        # 空元素写作<a />还是<a/>，按原文件中较多的写法（没有空元素时沿用标准库的<a />）
+        self.empty_element_space = text.count(' />') * 2 >= text.count('/>')
+
+    def _load_include_indexes(self):
+        """加载时为每个Target建立一次Include路径索引"""
+        self.targets = self.find_all_targets()
+        self.include_indexes = {}
+        for target_node, _ in self.targets:
+            self.stats.count('xml_searches')
+            cads = self.xml.find(target_node, './/Cads')
+            node = None
+            if cads is not None:
+                node = cads.find('VariousControls/IncludePath')
+            self.include_indexes[target_node] = IncludePathIndex(node)
+        self._default_include_index = None
+
+    def _load_file_index(self):
+        """加载时建立一次项目级文件路径索引：标准化路径 -> [(组, File元素)]，以及组名索引"""
+        self.file_index = {}
+        self.group_parents = {}
+        self.group_index = {}
+        for groups_node in self.root.iter('Groups'):
+            # 空的Groups节点也要登记，没有Target的旧格式工程依赖它查找Groups节点
+            self.group_index.setdefault(groups_node, {})
+            for group in groups_node.findall('Group'):
+                self._index_group(group, groups_node)
+
+    def _load_target_map(self):
+        """加载时建立一次Target映射：Target节点 -> TargetInfo（同名Target各自登记），以及Groups节点 -> Target节点"""
+        self.target_map = {}
+        self._groups_targets = {}
+        for target_node, target_name in self.targets:
+            self.stats.count('xml_searches')
+            self._register_target(target_node, target_name, target_node.find('Groups'),
+                                  match_targets(target_name, self.target_patterns))
+    
+    def _register_target(self, target_node, target_name, groups_node, selected):
+        """登记（或更新）一个Target的映射条目"""
+        info = TargetInfo(target_node, target_name, groups_node, self.include_indexes[target_node], selected)
+        self.target_map[target_node] = info
+        if groups_node is not None:
+            self.group_index.setdefault(groups_node, {})
+            self._groups_targets[groups_node] = target_node
+        return info
+    
+    @property
+    def selected_targets(self):
+        """选中的Target（TargetInfo列表，按工程中的顺序）"""
+        return [info for info in self.target_map.values() if info.selected]
+
+    def _index_group(self, group, groups_node):
+        """将组及其文件登记到索引中"""
+        self.group_parents[group] = groups_node
+        name_elem = group.find('GroupName')
+        if name_elem is not None and name_elem.text is not None:
+            # 同名的重复组只索引第一个
+            self.group_index.setdefault(groups_node, {}).setdefault(name_elem.text, group)
+        files = group.find('Files')
+        if files is None:
+            return
+        for file_elem in files.findall('File'):
+            file_path_elem = file_elem.find('FilePath')
+            if file_path_elem is not None and file_path_elem.text:
+                key = normalize_path_key(file_path_elem.text)
+                self.file_index.setdefault(key, []).append((group, file_elem))
+
+    def _unindex_group(self, group):
+        """从索引中移除组及其文件"""
+        groups_node = self.group_parents.pop(group, None)
+        name_elem = group.find('GroupName')
+        names = self.group_index.get(groups_node, {})
+        if name_elem is not None and names.get(name_elem.text) is group:
+            del names[name_elem.text]
+            # 若存在同名的重复组，改为索引下一个
+            for other in groups_node.findall('Group'):
+                other_name = other.find('GroupName')
+                if other is not group and other_name is not None and other_name.text == name_elem.text:
+                    names[name_elem.text] = other
+                    break
+        files = group.find('Files')
+        if files is None:
+            return
+        for file_elem in files.findall('File'):
+            file_path_elem = file_elem.find('FilePath')
+            if file_path_elem is None or not file_path_elem.text:
+                continue
+            key = normalize_path_key(file_path_elem.text)
+            entries = [e for e in self.file_index.get(key, []) if e[1] is not file_elem]
+            if entries:
+                self.file_index[key] = entries
+            else:
+                self.file_index.pop(key, None)
+
+    def get_groups_nodes(self, create=False):
+        """获取所有选中Target的Groups节点，create为True时为缺少Groups节点的Target创建"""
+        if not self.targets:
+            # 没有Target的旧格式工程，使用所有Groups节点
+            return list(self.group_index)
+        groups_nodes = []
+        for info in self.selected_targets:
+            if info.groups_node is None:
+                if not create:
+                    continue
+                groups_node = self.xml.SubElement(info.node, 'Groups')
+                info = self._register_target(info.node, info.name, groups_node, info.selected)
+                self.modified = True
+            groups_nodes.append(info.groups_node)
+        return groups_nodes
+    
+    def get_target(self, groups_node):
+        """获取Groups节点所属Target的TargetInfo，不属于任何Target时返回None"""
+        target_node = self._groups_targets.get(groups_node)
+        return self.target_map.get(target_node) if target_node is not None else None
+    
+    def is_selected_group(self, group):
+        """组是否属于选中的Target"""
+        info = self.get_target(self.group_parents.get(group))
+        return info.selected if info is not None else not self.targets
+    
+    def add_file_to_groups(self, file_path, groups_nodes, group_name):
+        """将文件添加到每个Groups节点下的同名组，返回是否至少添加了一处
+
+        组在首次实际添加文件时才创建，已包含该文件的Target不会产生空组；
+        重复文件的提示每个文件只输出一次。
+        """
+        _, key = self.resolve_path(file_path)
+        existing = {}
+        for group, _ in self.file_index.get(key, []):
+            existing.setdefault(self.group_parents.get(group), group)
+        added = False
+        duplicate = None
+        for groups_node in groups_nodes:
+            if groups_node in existing:
+                if duplicate is None:
+                    duplicate = existing[groups_node]
+                continue
+            group = self.find_group(groups_node, group_name)
+            if group is None:
+                group = self.create_group(groups_node, group_name)
+            if self.add_file(file_path, group, check_exists=False):
+                added = True
+        if duplicate is not None:
+            existing_name = duplicate.findtext('GroupName', '未知组')
+            if existing_name == group_name:
+                print(f"信息：文件 {os.path.basename(file_path)} 已存在于组中，跳过添加")
+            else:
+                print(f"信息：文件 {os.path.basename(file_path)} 已存在于组 '{existing_name}' 中，跳过添加")
+            self.stats.count('files_skipped_duplicate')
+        return added
+    
+    def find_group(self, groups_node, group_name):
+        """在Groups节点下按名称查找组（通过组名索引）"""
+        return self.group_index.get(groups_node, {}).get(group_name)
+
+    def create_group(self, groups_node, group_name):
+        """在Groups节点下创建新组并登记到索引"""
+        group = self.xml.SubElement(groups_node, 'Group')
+        group_name_elem = self.xml.SubElement(group, 'GroupName')
+        group_name_elem.text = group_name
+        self.group_parents[group] = groups_node
+        self.group_index.setdefault(groups_node, {}).setdefault(group_name, group)
+        self.modified = True
+        return group
+
+    def find_file(self, file_path):
+        """查找项目中引用该文件的所有 (组, File元素)"""
+        _, key = self.resolve_path(file_path)
+        return list(self.file_index.get(key, []))
+
+    def get_include_index(self, target_node):
+        """获取Target的Include路径索引，必要时创建IncludePath节点"""
+        index = self.include_indexes.get(target_node)
+        if index is None:
+            index = IncludePathIndex(None)
+            self.include_indexes[target_node] = index
+        if index.node is None:
+            index.node = self.find_include_path_node_for_target(target_node)
+            if index.node is None:
+                return None
+        return index
+
+    def get_default_include_index(self):
+        """获取默认Include路径索引（未找到Target时向后兼容）"""
+        if self._default_include_index is None:
+            node = self.find_include_path_node()
+            if node is None:
+                return None
+            self._default_include_index = IncludePathIndex(node)
+        return self._default_include_index
+
+    def get_include_paths(self, target_node=None):
+        """获取Target的Include路径列表（未指定Target时返回默认Include路径）"""
+        if target_node is None:
+            index = self.get_default_include_index()
+        else:
+            index = self.include_indexes.get(target_node)
+        return list(index.paths) if index is not None else []
+
+    def get_ignore_matcher(self, folder_path):
+        """获取文件夹的忽略规则（.keilignore + exclude），每个文件夹只编译一次"""
+        folder_path = os.path.abspath(folder_path)
+        matcher = self._ignore_matchers.get(folder_path)
+        if matcher is None:
+            matcher = IgnoreMatcher.for_folder(folder_path, self.exclude)
+            self._ignore_matchers[folder_path] = matcher
+        return matcher
+    
+    def walk(self, folder_path, extensions):
+        """遍历文件夹（应用忽略规则），统计遍历耗时和访问的目录数"""
+        batches = scan_source_tree(folder_path, extensions, self.jobs, self.get_ignore_matcher(folder_path))
+        for batch in self.stats.timed_iter('walk', batches):
+            self.stats.count('dirs_visited')
+            yield batch
+    
     def get_relative_path(self, absolute_path):
         """获取相对于项目文件的路径"""
+        return self.resolve_path(absolute_path)[0]
+    
+    def resolve_path(self, absolute_path):
+        """获取相对于项目文件的路径及其标准化键 (相对路径, 键)"""
         try:
-            abs_path = os.path.abspath(absolute_path)
-            rel_path = os.path.relpath(abs_path, self.project_dir)
-            
-            # 根据Keil的路径规则处理
-            # 如果路径不是以..开头，则添加../
-            if not rel_path.startswith('..') and not rel_path.startswith('./'):
-                return './' + rel_path
-            return rel_path
+            return self.path_resolver.resolve(absolute_path)
         except Exception as e:
             print(f"警告：计算路径 {absolute_path} 相对于 {self.project_dir} 的相对路径时出错：{str(e)}")
-            return absolute_path
+            return absolute_path, normalize_path_key(absolute_path)
+    
+    def resolve_project_path(self, rel_path):
+        """将工程中记录的相对路径解析为标准化的绝对路径，无法在本平台解析时返回None"""
+        rel_path = rel_path.strip().replace('\\', '/')
+        if os.name != 'nt' and re.match(r'^[A-Za-z]:', rel_path):
+            # Windows盘符路径在其他平台无法判断是否存在
+            return None
+        return os.path.normpath(os.path.join(self.project_dir, rel_path))
     
     def find_all_targets(self):
         """找到项目中的所有Target"""
         targets = []
-        for target in self.root.findall('.//Target'):
+        self.stats.count('xml_searches')
+        for target in self.xml.findall(self.root, './/Target'):
             target_name = target.find('TargetName')
             if target_name is not None:
                 targets.append((target, target_name.text))
@@ -41,209 +1483,166 @@ class KeilProjectManager:
     
     def find_include_path_node_for_target(self, target):
         """为特定Target找到Include路径节点"""
-        cads = target.find('.//Cads')
+        self.stats.count('xml_searches')
+        cads = self.xml.find(target, './/Cads')
         if cads is None:
             return None
         various_controls = cads.find('VariousControls')
         if various_controls is None:
-            various_controls = ET.SubElement(cads, 'VariousControls')
+            various_controls = self.xml.SubElement(cads, 'VariousControls')
+            self.modified = True
         include_path = various_controls.find('IncludePath')
         if include_path is None:
-            include_path = ET.SubElement(various_controls, 'IncludePath')
+            include_path = self.xml.SubElement(various_controls, 'IncludePath')
+            self.modified = True
         return include_path
         
     def find_include_path_node(self):
         """找到默认Target的Include路径节点（向后兼容）"""
-        cads = self.root.find('.//Cads')
+        self.stats.count('xml_searches')
+        cads = self.xml.find(self.root, './/Cads')
         if cads is None:
             print("警告：未找到Cads节点")
             return None
         various_controls = cads.find('VariousControls')
         if various_controls is None:
             print("警告：未找到VariousControls节点，尝试创建")
-            various_controls = ET.SubElement(cads, 'VariousControls')
+            various_controls = self.xml.SubElement(cads, 'VariousControls')
+            self.modified = True
         include_path = various_controls.find('IncludePath')
         if include_path is None:
             print("信息：未找到IncludePath节点，创建新节点")
-            include_path = ET.SubElement(various_controls, 'IncludePath')
+            include_path = self.xml.SubElement(various_controls, 'IncludePath')
+            self.modified = True
         return include_path
     
     def add_include_path_to_target(self, folder_path, target_node, target_name=None):
         """为特定Target添加Include路径"""
-        include_path_node = self.find_include_path_node_for_target(target_node)
-        if include_path_node is None:
+        index = self.get_include_index(target_node)
+        if index is None:
             print(f"警告：未找到Target '{target_name or 'unknown'}' 的Include路径节点，无法添加路径 {folder_path}")
             return False
             
         # 获取相对路径
-        rel_path = self.get_relative_path(folder_path)
-        
-        # 添加到现有Include路径
-        current_paths = []
-        if include_path_node.text:
-            # 分割路径并去除空白
-            current_paths = [p.strip() for p in include_path_node.text.split(';') if p.strip()]
+        rel_path, key = self.resolve_path(folder_path)
         
         # 检查路径是否已存在（忽略大小写和路径分隔符差异）
-        normalized_rel_path = rel_path.lower().replace('\\', '/').rstrip('/')
-        normalized_current_paths = [p.lower().replace('\\', '/').rstrip('/') for p in current_paths]
-        
-        if normalized_rel_path not in normalized_current_paths:
-            current_paths.append(rel_path)
-            include_path_node.text = ';'.join(current_paths)
-            if args.verbose:
+        if index.add(rel_path, key):
+            if self.verbose:
                 target_info = f" (Target: {target_name})" if target_name else ""
                 print(f"添加Include路径{target_info}: {rel_path}")
             return True
         return False
     
-    def remove_include_path_from_target(self, folder_path, target_node, target_name=None):
+    def remove_include_path_from_target(self, folder_path, target_node, target_name=None, include_subdirs=True):
         """从特定Target移除Include路径"""
-        include_path_node = self.find_include_path_node_for_target(target_node)
-        if include_path_node is None or not include_path_node.text:
+        index = self.include_indexes.get(target_node)
+        if index is None or not index.paths:
             return False
             
         # 获取相对路径
-        rel_path = self.get_relative_path(folder_path)
-        
-        # 从现有Include路径中移除
-        current_paths = [p.strip() for p in include_path_node.text.split(';') if p.strip()]
-        if not current_paths:
-            return False
-            
-        # 标准化路径进行比较
-        normalized_rel_path = rel_path.lower().replace('\\', '/').rstrip('/')
-        normalized_current_paths = [(p, p.lower().replace('\\', '/').rstrip('/')) for p in current_paths]
+        rel_path, key = self.resolve_path(folder_path)
         
         # 查找匹配的路径 - 删除精确匹配和子目录
-        removed = False
-        new_paths = []
-        for orig_path, norm_path in normalized_current_paths:
-            # 检查是否为目标路径或其子路径
-            if norm_path == normalized_rel_path or norm_path.startswith(normalized_rel_path + '/'):
-                removed = True
-                if args.verbose:
-                    target_info = f" (Target: {target_name})" if target_name else ""
-                    print(f"移除Include路径{target_info}: {orig_path}")
-            else:
-                new_paths.append(orig_path)
-        
-        if removed:
-            include_path_node.text = ';'.join(new_paths) if new_paths else ""
+        removed_paths = index.remove(rel_path, include_subdirs=include_subdirs, key=key)
+        if self.verbose:
+            target_info = f" (Target: {target_name})" if target_name else ""
+            for orig_path in removed_paths:
+                print(f"移除Include路径{target_info}: {orig_path}")
         
-        return removed
+        return bool(removed_paths)
         
+    @journaled
+    @timed('add_include_path')
     def add_include_path(self, folder_path):
-        """添加Include路径到所有Target"""
-        targets = self.find_all_targets()
-        
-        if not targets:
+        """添加Include路径到所有选中的Target"""
+        if not self.targets:
             print("警告：未找到任何Target，尝试使用旧方法添加Include路径")
             # 向后兼容的方法
-            include_path_node = self.find_include_path_node()
-            if include_path_node is None:
+            index = self.get_default_include_index()
+            if index is None:
                 print(f"警告：未找到Include路径节点，无法添加路径 {folder_path}")
                 return
                 
             # 获取相对路径
-            rel_path = self.get_relative_path(folder_path)
-            
-            # 添加到现有Include路径
-            current_paths = []
-            if include_path_node.text:
-                # 分割路径并去除空白
-                current_paths = [p.strip() for p in include_path_node.text.split(';') if p.strip()]
+            rel_path, key = self.resolve_path(folder_path)
             
             # 检查路径是否已存在（忽略大小写和路径分隔符差异）
-            normalized_rel_path = rel_path.lower().replace('\\', '/').rstrip('/')
-            normalized_current_paths = [p.lower().replace('\\', '/').rstrip('/') for p in current_paths]
-            
-            if normalized_rel_path not in normalized_current_paths:
-                current_paths.append(rel_path)
-                include_path_node.text = ';'.join(current_paths)
-                if args.verbose:
+            if index.add(rel_path, key):
+                if self.verbose:
                     print(f"添加Include路径: {rel_path}")
             return
         
         # 为每个Target添加Include路径
         added = False
-        for target_node, target_name in targets:
-            if self.add_include_path_to_target(folder_path, target_node, target_name):
+        for info in self.selected_targets:
+            if self.add_include_path_to_target(folder_path, info.node, info.name):
                 added = True
         
-        if not added and args.verbose:
+        if not added and self.verbose:
             print(f"信息：路径 {folder_path} 已存在于所有Target的Include路径中")
     
-    def remove_include_path(self, folder_path):
-        """从所有Target移除Include路径"""
-        targets = self.find_all_targets()
-        
-        if not targets:
+    @journaled
+    @timed('remove_include_path')
+    def remove_include_path(self, folder_path, include_subdirs=True):
+        """从所有选中的Target移除Include路径"""
+        if not self.targets:
             print("警告：未找到任何Target，尝试使用旧方法移除Include路径")
             # 向后兼容的方法
-            include_path_node = self.find_include_path_node()
-            if include_path_node is None or not include_path_node.text:
+            index = self.get_default_include_index()
+            if index is None or not index.paths:
                 return
                 
             # 获取相对路径
-            rel_path = self.get_relative_path(folder_path)
-            
-            # 从现有Include路径中移除
-            current_paths = [p.strip() for p in include_path_node.text.split(';') if p.strip()]
-            if not current_paths:
-                return
-                
-            # 标准化路径进行比较
-            normalized_rel_path = rel_path.lower().replace('\\', '/').rstrip('/')
-            normalized_current_paths = [(p, p.lower().replace('\\', '/').rstrip('/')) for p in current_paths]
+            rel_path, key = self.resolve_path(folder_path)
             
             # 查找匹配的路径
-            removed = False
-            new_paths = []
-            for orig_path, norm_path in normalized_current_paths:
-                if norm_path == normalized_rel_path:
-                    removed = True
-                    if args.verbose:
-                        print(f"移除Include路径: {orig_path}")
-                else:
-                    new_paths.append(orig_path)
-            
-            if removed:
-                include_path_node.text = ';'.join(new_paths) if new_paths else ""
+            for orig_path in index.remove(rel_path, key=key):
+                if self.verbose:
+                    print(f"移除Include路径: {orig_path}")
             return
         
         # 从每个Target移除Include路径
         removed = False
-        for target_node, target_name in targets:
-            if self.remove_include_path_from_target(folder_path, target_node, target_name):
+        for info in self.selected_targets:
+            if self.remove_include_path_from_target(folder_path, info.node, info.name, include_subdirs):
                 removed = True
         
-        if not removed and args.verbose:
+        if not removed and self.verbose:
             print(f"信息：未在任何Target中找到路径 {folder_path}")
     
-    def add_file(self, file_path, group):
-        """添加文件到分组"""
+    @timed('add_file')
+    def add_file(self, file_path, group, check_exists=True):
+        """添加文件到分组，返回是否实际添加（check_exists为False时跳过存在性检查，用于扫描器已确认的文件）"""
         # 检查文件是否存在
-        if not os.path.exists(file_path):
+        if check_exists and not os.path.exists(file_path):
             print(f"警告：文件 {file_path} 不存在，跳过添加")
-            return
+            self.stats.count('files_missing')
+            return False
             
         files = group.find('Files')
         if files is None:
-            files = ET.SubElement(group, 'Files')
+            files = self.xml.SubElement(group, 'Files')
             
         # 使用相对路径
-        rel_path = self.get_relative_path(file_path)
+        rel_path, key = self.resolve_path(file_path)
         
-        # 检查文件是否已存在于组中
-        for file_elem in files.findall('File'):
-            file_path_elem = file_elem.find('FilePath')
-            if file_path_elem is not None and file_path_elem.text == rel_path:
+        # 检查文件是否已存在于组中或同一Target的其他组中
+        groups_node = self.group_parents.get(group)
+        for existing_group, _ in self.file_index.get(key, []):
+            if existing_group is group:
                 print(f"信息：文件 {os.path.basename(file_path)} 已存在于组中，跳过添加")
-                return
+                self.stats.count('files_skipped_duplicate')
+                return False
+            if groups_node is not None and self.group_parents.get(existing_group) is groups_node:
+                name_elem = existing_group.find('GroupName')
+                existing_name = name_elem.text if name_elem is not None else "未知组"
+                print(f"信息：文件 {os.path.basename(file_path)} 已存在于组 '{existing_name}' 中，跳过添加")
+                self.stats.count('files_skipped_duplicate')
+                return False
         
-        file_elem = ET.SubElement(files, 'File')
-        file_name = ET.SubElement(file_elem, 'FileName')
+        file_elem = self.xml.SubElement(files, 'File')
+        file_name = self.xml.SubElement(file_elem, 'FileName')
         file_name.text = os.path.basename(file_path)
         
         # 根据文件扩展名设置文件类型
@@ -263,140 +1662,432 @@ class KeilProjectManager:
         else:
             file_type = '1'  # 默认为C源文件
         
-        file_type_elem = ET.SubElement(file_elem, 'FileType')
+        file_type_elem = self.xml.SubElement(file_elem, 'FileType')
         file_type_elem.text = file_type
         
-        file_path_elem = ET.SubElement(file_elem, 'FilePath')
+        file_path_elem = self.xml.SubElement(file_elem, 'FilePath')
         file_path_elem.text = rel_path
+        self.file_index.setdefault(key, []).append((group, file_elem))
+        self.modified = True
+        self.stats.count('files_added')
+        return True
         
+    @journaled
     def scan_and_add_files_to_single_group(self, folder_path, group_name=None):
-        """扫描文件夹并将所有文件添加到单一分组中"""
+        """扫描文件夹并将所有文件添加到单一分组中，返回新增文件数"""
         folder_path = Path(folder_path)
-        groups_node = self.root.find('.//Groups')
-        if groups_node is None:
+        groups_nodes = self.get_groups_nodes(create=True)
+        if not groups_nodes:
             print("错误：未找到Groups节点")
-            return
+            return 0
             
-        # 添加基础Include路径
-        self.add_include_path(str(folder_path))
+        # 添加基础Include路径（Include分析模式下只添加实际需要的目录）
+        if not self.analyze_includes:
+            self.add_include_path(str(folder_path))
         
         # 如果未提供组名，则使用文件夹名称
         if group_name is None:
             group_name = folder_path.name
             
-        # 创建或查找组
-        group = None
-        for g in groups_node.findall('Group'):
-            name_elem = g.find('GroupName')
-            if name_elem is not None and name_elem.text == group_name:
-                group = g
-                break
-                
-        if group is None:
-            group = ET.SubElement(groups_node, 'Group')
-            group_name_elem = ET.SubElement(group, 'GroupName')
-            group_name_elem.text = group_name
-            
         # 递归遍历文件夹
-        for root, dirs, files in os.walk(folder_path):
+        added_files = 0
+        scanned_files = []
+        pending_headers = []
+        extensions = ('.c', '.cpp', '.h', '.hpp', '.s', '.asm')
+        for root, headers, source_files in self.walk(folder_path, extensions):
             # 添加Include路径 - 只添加包含头文件的目录
-            has_header = any(f.endswith(('.h', '.hpp')) for f in files)
-            if has_header:
+            if headers and not self.analyze_includes:
                 self.add_include_path(root)
             
-            # 筛选符合条件的文件
-            source_files = [f for f in files if f.endswith(('.c', '.cpp', '.h', '.hpp', '.s', '.asm'))]
-            
-            # 添加文件到同一个组
+            # 添加文件到同一个组（只添加可达头文件时，头文件待分析后再添加）
             for src_file in source_files:
                 file_path = os.path.join(root, src_file)
-                self.add_file(file_path, group)
+                scanned_files.append(file_path)
+                if self.reachable_headers_only and src_file.endswith(('.h', '.hpp')):
+                    pending_headers.append((file_path, group_name))
+                elif self.add_file_to_groups(file_path, groups_nodes, group_name):
+                    added_files += 1
+        
+        added_files += self.finish_include_analysis(groups_nodes, scanned_files, pending_headers)
+        return added_files
+    
+    def get_existing_include_dirs(self):
+        """选中Target已有的Include目录（绝对路径）"""
+        dirs = []
+        indexes = [info.include_index for info in self.selected_targets]
+        if not self.targets and self.get_default_include_index() is not None:
+            indexes = [self._default_include_index]
+        for index in indexes:
+            for path in index.paths:
+                dirs.append(os.path.normpath(os.path.join(self.project_dir, path.replace('\\', '/'))))
+        return list(dict.fromkeys(dirs))
+    
+    @timed('include_analysis')
+    def analyze_file_includes(self, files):
+        """分析文件的#include依赖，返回IncludeAnalysis"""
+        headers = [f for f in files if f.lower().endswith(('.h', '.hpp'))]
+        sources = [f for f in files if not f.lower().endswith(('.h', '.hpp'))]
+        cache = IncludeCache(self.project_file)
+        cache.load()
+        analyzer = IncludeAnalyzer(headers, self.get_existing_include_dirs(), cache, self.jobs)
+        analysis = analyzer.analyze(sources)
+        if not self.dry_run:
+            cache.save()
+        self.stats.count('include_dirs_required', len(analysis.include_dirs))
+        self.stats.count('includes_unresolved', len(analysis.unresolved))
+        return analysis
     
-    def scan_and_add_files(self, folder_path):
-        """扫描文件夹并添加文件"""
+    def finish_include_analysis(self, groups_nodes, scanned_files, pending_headers):
+        """扫描结束后按需执行Include分析：只添加需要的Include目录、只添加可达的头文件
+
+        pending_headers为 [(头文件路径, 组名)]，返回新增的头文件数。
+        """
+        if not (self.analyze_includes or self.reachable_headers_only):
+            return 0
+        analysis = self.analyze_file_includes(scanned_files)
+        
+        if self.analyze_includes:
+            for include_dir in analysis.include_dirs:
+                self.add_include_path(include_dir)
+            print(f"Include分析: 需要{len(analysis.include_dirs)}个Include目录, {len(analysis.unresolved)}个#include未能解析")
+            if self.verbose:
+                for file_path, name in analysis.unresolved:
+                    print(f"  未解析: {self.get_relative_path(file_path)} -> {name}")
+        
+        added_files = 0
+        if self.reachable_headers_only:
+            reachable = {normalize_path_key(path) for path in analysis.reachable_headers}
+            skipped = []
+            for file_path, group_name in pending_headers:
+                if normalize_path_key(file_path) not in reachable:
+                    skipped.append(file_path)
+                    continue
+                if self.add_file_to_groups(file_path, groups_nodes, group_name):
+                    added_files += 1
+            self.stats.count('headers_unreachable', len(skipped))
+            print(f"头文件可达性: {len(pending_headers) - len(skipped)}个头文件被源文件引用, 跳过{len(skipped)}个未被引用的头文件")
+            if self.verbose:
+                for file_path in skipped:
+                    print(f"  跳过: {self.get_relative_path(file_path)}")
+        return added_files
+    
+    def recursive_group_name(self, folder_path, dirpath):
+        """递归模式下目录对应的组名：文件夹名/相对子路径"""
         folder_path = Path(folder_path)
-        groups_node = self.root.find('.//Groups')
-        if groups_node is None:
-            return
+        relative_path = Path(dirpath).relative_to(folder_path)
+        if str(relative_path) == '.':
+            return folder_path.name
+        return f"{folder_path.name}/{str(relative_path).replace(os.sep, '/')}"
+    
+    @journaled
+    def scan_and_add_files(self, folder_path, prune_groups=False):
+        """扫描文件夹并添加文件，返回新增文件数
+
+        已存在的同名组会被复用并合并新文件，重复运行不会产生重复的组；
+        prune_groups为True时移除该文件夹下目录已不存在的组。
+        """
+        folder_path = Path(folder_path)
+        groups_nodes = self.get_groups_nodes(create=True)
+        if not groups_nodes:
+            return 0
+            
+        # 添加基础Include路径（Include分析模式下只添加实际需要的目录）
+        if not self.analyze_includes:
+            self.add_include_path(str(folder_path))
+        
+        # 遍历文件夹
+        added_files = 0
+        scanned_files = []
+        pending_headers = []
+        walked_groups = set()
+        extensions = ('.c', '.cpp', '.h', '.hpp', '.s')
+        for root, _, source_files in self.walk(folder_path, extensions):
+            # 构建组名
+            group_name = self.recursive_group_name(folder_path, root)
+            walked_groups.add(group_name)
+                
+            # 检查是否有源文件（支持 .c .cpp .h .hpp .s）
+            if not source_files:
+                continue
+            
+            # 只添加可达头文件时，头文件待分析后再添加
+            if self.reachable_headers_only:
+                for c_file in source_files:
+                    if c_file.endswith(('.h', '.hpp')):
+                        pending_headers.append((os.path.join(root, c_file), group_name))
+                scanned_files.extend(os.path.join(root, c_file) for c_file in source_files)
+                source_files = [f for f in source_files if not f.endswith(('.h', '.hpp'))]
             
-        # 添加基础Include路径
-        self.add_include_path(str(folder_path))
+            # 添加文件（组在首次实际添加文件时才创建）
+            for c_file in source_files:
+                file_path = os.path.join(root, c_file)
+                if not self.reachable_headers_only:
+                    scanned_files.append(file_path)
+                if self.add_file_to_groups(file_path, groups_nodes, group_name):
+                    added_files += 1
+                
+            # 添加Include路径
+            if not self.analyze_includes:
+                self.add_include_path(root)
+        
+        added_files += self.finish_include_analysis(groups_nodes, scanned_files, pending_headers)
+        
+        if prune_groups:
+            for groups_node in groups_nodes:
+                self.prune_vanished_groups(groups_node, folder_path, walked_groups)
+        return added_files
+    
+    def prune_vanished_groups(self, groups_node, folder_path, walked_groups):
+        """移除递归模式下属于该文件夹、但对应目录已不存在(未被遍历到)的组及该目录的Include路径，返回移除的组数"""
+        folder_path = Path(folder_path)
+        folder_name = folder_path.name
+        info = self.get_target(groups_node)
+        removed = 0
+        for group_name, group in list(self.group_index.get(groups_node, {}).items()):
+            if group_name != folder_name and not group_name.startswith(folder_name + '/'):
+                continue
+            if group_name not in walked_groups:
+                self.remove_group(group)
+                # 子目录各有自己的组，只移除该目录本身的Include路径
+                dirpath = str(folder_path.joinpath(*group_name.split('/')[1:]))
+                if info is not None:
+                    self.remove_include_path_from_target(dirpath, info.node, info.name, include_subdirs=False)
+                else:
+                    self.remove_include_path(dirpath, include_subdirs=False)
+                removed += 1
+        self.stats.count('groups_pruned', removed)
+        return removed
+                
+    @journaled
+    def scan_incremental(self, folder_path, group_name=None, recursive=False):
+        """基于扫描清单增量同步文件夹：只处理mtime变化的目录中新增和删除的文件，返回新增文件数
+
+        清单不存在或工程文件被外部修改时自动回退为完整扫描。
+        """
+        folder_path = os.path.abspath(folder_path)
+        if not self.get_groups_nodes(create=True):
+            print("错误：未找到Groups节点")
+            return 0
+        
+        if recursive:
+            extensions = ('.c', '.cpp', '.h', '.hpp', '.s')
+        else:
+            extensions = ('.c', '.cpp', '.h', '.hpp', '.s', '.asm')
+        if group_name is None:
+            group_name = os.path.basename(folder_path)
+        
+        self.manifest = ScanManifest(self.project_file)
+        self.manifest.load()
+        ignore = self.get_ignore_matcher(folder_path)
+        # 忽略规则变化时清单记录失效
+        rules_hash = hash_data('\n'.join(ignore.patterns).encode('utf-8'))[:16]
+        targets = ','.join(info.name for info in self.selected_targets)
+        scan_key = f"{'recursive' if recursive else 'single'}|{folder_path}|{group_name}|{rules_hash}|{targets}"
+        previous = self.manifest.get_scan(scan_key, hash_data(self.original_data))
+        if not previous:
+            if self.verbose:
+                print("信息：扫描清单不存在或工程文件已被外部修改，执行完整扫描")
+            self.add_include_path(folder_path)
+        
+        with self.stats.phase('walk'):
+            state, changed = scan_source_tree_incremental(folder_path, extensions, previous, self.jobs, ignore)
+        self.stats.count('dirs_visited', len(state))
+        self.stats.count('dirs_rescanned', len(changed))
+        added_files, removed_files = self.apply_scan_changes(folder_path, group_name, recursive, previous, state, changed)
+        
+        self.manifest.scans[scan_key] = state
+        if self.verbose:
+            print(f"增量扫描: 重新列举{len(changed)}个目录, 新增{added_files}个文件, 移除{removed_files}个文件")
+        return added_files
+    
+    @journaled
+    def apply_scan_changes(self, folder_path, group_name, recursive, previous, state, changed):
+        """将两次扫描之间的目录变化应用到项目，返回 (新增文件数, 移除文件数)"""
+        groups_nodes = self.get_groups_nodes(create=True)
+        if not groups_nodes:
+            print("错误：未找到Groups节点")
+            return 0, 0
+        added_files = 0
+        removed_files = 0
+        
+        # 已消失的目录：移除其中的文件和Include路径
+        for dirpath, entry in previous.items():
+            if dirpath in state:
+                continue
+            for name in entry['files']:
+                if self.remove_file(os.path.join(dirpath, name)):
+                    removed_files += 1
+            if entry['headers']:
+                self.remove_include_path(dirpath, include_subdirs=False)
         
-        # 遍历文件夹
-        for root, dirs, files in os.walk(folder_path):
-            current_path = Path(root)
-            relative_path = current_path.relative_to(folder_path)
+        # 变化或新出现的目录：应用文件差异
+        for dirpath in changed:
+            entry = state[dirpath]
+            prev = previous.get(dirpath)
+            old_files = set(prev['files']) if prev else set()
+            new_files = set(entry['files'])
             
-            # 构建组名
-            if str(relative_path) == '.':
-                group_name = folder_path.name
-            else:
-                group_name = f"{folder_path.name}/{str(relative_path).replace(os.sep, '/')}"
-                
-            # 检查是否有.c文件
-            # source_files = [f for f in files if f.endswith('.c')]
-            # 增加其他文件类型支持 .c .cpp .h .hpp .s
-            source_files = [f for f in files if f.endswith(('.c', '.cpp', '.h', '.hpp', '.s'))]
-            if not source_files:
-                continue
-                
-            # 创建组
-            group = ET.SubElement(groups_node, 'Group')
-            group_name_elem = ET.SubElement(group, 'GroupName')
-            group_name_elem.text = group_name
+            for name in prev['files'] if prev else []:
+                if name not in new_files and self.remove_file(os.path.join(dirpath, name)):
+                    removed_files += 1
             
-            # 添加文件
-            for c_file in source_files:
-                file_path = os.path.join(root, c_file)
-                self.add_file(file_path, group)
-                
-            # 添加Include路径
-            self.add_include_path(root)
-                
+            if entry['headers']:
+                self.add_include_path(dirpath)
+            elif prev and prev['headers']:
+                self.remove_include_path(dirpath, include_subdirs=False)
+            
+            new_names = [name for name in entry['files'] if name not in old_files]
+            if not new_names:
+                continue
+            name = self.recursive_group_name(folder_path, dirpath) if recursive else group_name
+            for file_name in new_names:
+                if self.add_file_to_groups(os.path.join(dirpath, file_name), groups_nodes, name):
+                    added_files += 1
+        
+        return added_files, removed_files
+    
+    @journaled
+    def sync_folder(self, folder_path, group_name=None, recursive=False):
+        """同步文件夹与项目：一次遍历计算磁盘与项目的差集，只应用必要的增删
+
+        返回 (新增文件数, 移除文件数, 新增Include路径数, 移除Include路径数)。
+        """
+        folder_path = os.path.abspath(folder_path)
+        groups_nodes = self.get_groups_nodes(create=True)
+        if not groups_nodes:
+            print("错误：未找到Groups节点")
+            return 0, 0, 0, 0
+        if group_name is None:
+            group_name = os.path.basename(folder_path)
+        if recursive:
+            extensions = ('.c', '.cpp', '.h', '.hpp', '.s')
+        else:
+            extensions = ('.c', '.cpp', '.h', '.hpp', '.s', '.asm')
+        
+        _, folder_key = self.resolve_path(folder_path)
+        
+        def under_folder(key):
+            return key == folder_key or key.startswith(folder_key + '/')
+        
+        # 磁盘上的文件和包含头文件的目录
+        disk_files = []
+        disk_file_keys = set()
+        include_dirs = [folder_path]
+        for root, headers, source_files in self.walk(folder_path, extensions):
+            if headers:
+                include_dirs.append(root)
+            for name in source_files:
+                file_path = os.path.join(root, name)
+                _, key = self.resolve_path(file_path)
+                disk_files.append((root, file_path, key))
+                disk_file_keys.add(key)
+        include_keys = {self.resolve_path(d)[1] for d in include_dirs}
+        
+        # 移除磁盘上已不存在（或已被忽略规则排除）的文件条目；
+        # 扫描器不列出的扩展名（如.lib）不能用扫描结果判断，逐目录检查是否存在
+        removed_files = 0
+        listing = DirectoryListing(self.stats)
+        ignore = self.get_ignore_matcher(folder_path)
+        
+        def is_stale(key):
+            path_text = self.file_index[key][0][1].findtext('FilePath', '').strip()
+            file_path = self.resolve_project_path(path_text)
+            if file_path is None:
+                return False
+            if not listing.exists(file_path):
+                return True
+            if not path_text.endswith(extensions) or not ignore:
+                return False
+            parts = os.path.relpath(file_path, folder_path).replace(os.sep, '/').split('/')
+            return (ignore.match('/'.join(parts))
+                    or any(ignore.match('/'.join(parts[:i]), True) for i in range(1, len(parts))))
+        
+        stale_keys = [key for key in self.file_index
+                      if under_folder(key) and key not in disk_file_keys and is_stale(key)]
+        for key in stale_keys:
+            if self.remove_file_by_key(key):
+                removed_files += 1
+        
+        # 添加新文件：只添加到尚未包含该文件的Target
+        added_files = 0
+        for root, file_path, key in disk_files:
+            present = {self.group_parents.get(group) for group, _ in self.file_index.get(key, [])}
+            missing_nodes = [node for node in groups_nodes if node not in present]
+            if not missing_nodes:
+                continue
+            name = self.recursive_group_name(folder_path, root) if recursive else group_name
+            if self.add_file_to_groups(file_path, missing_nodes, name):
+                added_files += 1
+        
+        # 修剪不再包含头文件的目录的Include路径
+        removed_includes = 0
+        indexes = [(info.name, info.include_index) for info in self.selected_targets]
+        if not self.targets and self.get_default_include_index() is not None:
+            indexes = [(None, self._default_include_index)]
+        for target_name, index in indexes:
+            stale = index.filter_paths(lambda path, key: not under_folder(key) or key in include_keys)
+            removed_includes += len(stale)
+            if self.verbose:
+                target_info = f" (Target: {target_name})" if target_name else ""
+                for path in stale:
+                    print(f"移除Include路径{target_info}: {path}")
+        
+        # 添加缺失的Include路径
+        added_includes = 0
+        for dirpath in include_dirs:
+            _, key = self.resolve_path(dirpath)
+            if all(key in index.keys for _, index in indexes):
+                continue
+            self.add_include_path(dirpath)
+            added_includes += 1
+        
+        return added_files, removed_files, added_includes, removed_includes
+    
+    @journaled
     def remove_file(self, file_path):
         """从项目中移除文件"""
-        rel_path = self.get_relative_path(file_path)
-        removed = False
+        _, key = self.resolve_path(file_path)
+        return self.remove_file_by_key(key)
+    
+    @journaled
+    @timed('remove_file')
+    def remove_file_by_key(self, key):
+        """按标准化路径键从选中Target的组中移除文件"""
+        # 通过索引查找所有组中的匹配文件，未选中Target中的条目保留
+        entries = [e for e in self.file_index.get(key, []) if self.is_selected_group(e[0])]
+        if not entries:
+            return False
+        kept = [e for e in self.file_index[key] if not self.is_selected_group(e[0])]
+        if kept:
+            self.file_index[key] = kept
+        else:
+            del self.file_index[key]
         
-        # 在所有组中查找文件
-        for group in self.root.findall('.//Group'):
+        for group, file_elem in entries:
             files = group.find('Files')
             if files is None:
                 continue
-                
-            # 查找匹配的文件
-            to_remove = []
-            for file_elem in files.findall('File'):
-                file_path_elem = file_elem.find('FilePath')
-                if file_path_elem is not None:
-                    file_path_text = file_path_elem.text
-                    # 标准化路径进行比较
-                    if file_path_text.lower().replace('\\', '/') == rel_path.lower().replace('\\', '/'):
-                        to_remove.append(file_elem)
-            
-            # 移除找到的文件
-            for file_elem in to_remove:
-                file_name = file_elem.find('FileName')
-                file_name_text = file_name.text if file_name is not None else os.path.basename(rel_path)
-                files.remove(file_elem)
-                removed = True
-                if args.verbose:
-                    group_name = group.find('GroupName')
-                    group_name_text = group_name.text if group_name is not None else "未知组"
-                    print(f"从组 '{group_name_text}' 移除文件: {file_name_text}")
+            file_name = file_elem.find('FileName')
+            file_name_text = file_name.text if file_name is not None else os.path.basename(key)
+            remove_element(files, file_elem)
+            self.modified = True
+            self.stats.count('files_removed')
+            if self.verbose:
+                group_name = group.find('GroupName')
+                group_name_text = group_name.text if group_name is not None else "未知组"
+                print(f"从组 '{group_name_text}' 移除文件: {file_name_text}")
         
-        return removed
+        return True
     
+    @journaled
     def remove_files_in_folder(self, folder_path):
         """移除文件夹中的所有文件"""
         folder_path = Path(folder_path)
         removed_files = 0
         
         # 递归遍历文件夹
-        for root, _, files in os.walk(folder_path):
-            # 筛选符合条件的文件
-            source_files = [f for f in files if f.endswith(('.c', '.cpp', '.h', '.hpp', '.s', '.asm'))]
-            
+        extensions = ('.c', '.cpp', '.h', '.hpp', '.s', '.asm')
+        for root, _, source_files in self.walk(folder_path, extensions):
             # 移除每个文件
             for src_file in source_files:
                 file_path = os.path.join(root, src_file)
@@ -405,40 +2096,139 @@ class KeilProjectManager:
         
         return removed_files
     
-    def print_all_include_paths(self):
-        """打印所有Include路径"""
-        targets = self.find_all_targets()
+    @journaled
+    @timed('compact')
+    def compact(self):
+        """一次遍历清理工程：Include路径去重并移除不存在的目录，移除不存在和重复的文件条目以及空组，返回各类移除计数"""
+        listing = DirectoryListing(self.stats)
+        counts = {'include_paths': 0, 'missing_files': 0, 'duplicate_files': 0, 'empty_groups': 0}
         
-        if not targets:
-            include_node = self.find_include_path_node()
-            if include_node is not None and include_node.text:
+        # Include路径：按解析后的目录去重（覆盖大小写、分隔符和./差异），并移除不存在的目录
+        indexes = [info.include_index for info in self.selected_targets]
+        if self._default_include_index is not None:
+            indexes.append(self._default_include_index)
+        for index in indexes:
+            seen = set()
+            
+            def keep(path):
+                resolved = self.resolve_project_path(path)
+                if resolved is None:
+                    return True
+                key = resolved.lower()
+                if key in seen or not listing.is_dir(resolved):
+                    return False
+                seen.add(key)
+                return True
+            
+            removed = index.retain(keep)
+            counts['include_paths'] += len(removed)
+            if self.verbose:
+                for path in removed:
+                    print(f"移除冗余Include路径: {path}")
+        
+        # 文件：移除不存在的文件，同一Groups节点下重复的条目只保留第一个
+        for key, all_entries in list(self.file_index.items()):
+            entries = [e for e in all_entries if self.is_selected_group(e[0])]
+            if not entries:
+                continue
+            file_path_elem = entries[0][1].find('FilePath')
+            resolved = self.resolve_project_path(file_path_elem.text)
+            if resolved is not None and not listing.exists(resolved):
+                counts['missing_files'] += len(entries)
+                self.remove_file_by_key(key)
+                continue
+            seen_groups_nodes = set()
+            kept = []
+            for group, file_elem in entries:
+                groups_node = self.group_parents.get(group)
+                if groups_node in seen_groups_nodes:
+                    remove_element(group.find('Files'), file_elem)
+                    self.modified = True
+                    counts['duplicate_files'] += 1
+                    if self.verbose:
+                        print(f"移除重复文件条目: {file_path_elem.text}")
+                else:
+                    seen_groups_nodes.add(groups_node)
+                    kept.append((group, file_elem))
+            kept_elems = {id(file_elem) for _, file_elem in kept}
+            self.file_index[key] = [e for e in all_entries
+                                    if id(e[1]) in kept_elems or not self.is_selected_group(e[0])]
+        
+        # 空组
+        for group in [g for g in self.group_parents if self.is_selected_group(g)]:
+            files = group.find('Files')
+            if files is None or files.find('File') is None:
+                self.remove_group(group)
+                counts['empty_groups'] += 1
+        
+        return counts
+    
+    @journaled
+    def add_folder(self, folder_path, group_name=None, recursive=False, incremental=False, prune_groups=False):
+        """按添加模式处理文件夹，返回新增文件数"""
+        if incremental:
+            # 增量模式，根据扫描清单只处理变化的目录
+            return self.scan_incremental(folder_path, group_name, recursive)
+        if recursive:
+            # 使用原始方法，递归创建文件夹结构
+            return self.scan_and_add_files(folder_path, prune_groups)
+        # 使用新方法，将所有文件添加到单一组
+        return self.scan_and_add_files_to_single_group(folder_path, group_name)
+    
+    @journaled
+    def delete_folder(self, folder_path, group_name=None):
+        """删除文件夹中的文件和Include路径，并删除对应的组
+
+        返回 (移除文件数, 被删除的组名或None)。
+        """
+        removed_files = self.remove_files_in_folder(folder_path)
+        self.remove_include_path(folder_path)
+        
+        # 如果指定了组名，删除该组，否则尝试查找与文件夹名相同的组并删除
+        if group_name is None:
+            group_name = os.path.basename(folder_path)
+        if self.remove_group_by_name(group_name):
+            return removed_files, group_name
+        return removed_files, None
+    
+    def print_all_include_paths(self):
+        """打印选中Target的所有Include路径"""
+        if not self.targets:
+            paths = self.get_include_paths()
+            if paths:
                 print("\n所有Include路径:")
-                paths = [p.strip() for p in include_node.text.split(';') if p.strip()]
                 for path in paths:
                     print(f"  - {path}")
-                return len(paths)
-            return 0
+            return len(paths)
         
         total_paths = 0
-        for target_node, target_name in targets:
-            include_node = self.find_include_path_node_for_target(target_node)
-            if include_node is not None and include_node.text:
-                paths = [p.strip() for p in include_node.text.split(';') if p.strip()]
-                if paths:
-                    print(f"\nTarget '{target_name}' 的Include路径:")
-                    for path in paths:
-                        print(f"  - {path}")
-                    total_paths += len(paths)
+        for info in self.selected_targets:
+            paths = self.get_include_paths(info.node)
+            if paths:
+                print(f"\nTarget '{info.name}' 的Include路径:")
+                for path in paths:
+                    print(f"  - {path}")
+                total_paths += len(paths)
         
         return total_paths
     
     def print_all_groups_and_files(self):
-        """打印所有组和文件"""
-        groups_node = self.root.find('.//Groups')
-        if groups_node is None:
+        """按Target打印选中Target的所有组和文件"""
+        groups_nodes = self.get_groups_nodes()
+        if not groups_nodes:
             print("未找到任何组")
             return 0
             
+        total_files = 0
+        for groups_node in groups_nodes:
+            target_name = self.get_target_name(groups_node)
+            if target_name is not None:
+                print(f"\nTarget '{target_name}':")
+            total_files += self._print_groups(groups_node)
+        return total_files
+    
+    def _print_groups(self, groups_node):
+        """打印一个Groups节点下的组和文件，返回文件数"""
         total_files = 0
         for group in groups_node.findall('Group'):
             group_name = group.find('GroupName')
@@ -465,177 +2255,997 @@ class KeilProjectManager:
         
         return total_files
     
+    def get_target_name(self, groups_node):
+        """获取Groups节点所属的Target名称"""
+        info = self.get_target(groups_node)
+        return info.name if info is not None else None
+    
+    def query_files(self, target=None, group=None, pattern=None, file_type=None):
+        """按Target、组名、路径通配符和文件类型查询文件，产出文件记录
+
+        target可为单个或多个通配符，group和pattern支持通配符，file_type可为类型代码('1')或名称('c')。
+        """
+        targets = [target] if isinstance(target, str) else target
+        if group is not None and not glob.has_magic(group):
+            # 精确组名直接通过组名索引查找
+            groups = [(g, node) for node, names in self.group_index.items()
+                      for g in [names.get(group)] if g is not None]
+        else:
+            groups = list(self.group_parents.items())
+        for group_elem, groups_node in groups:
+            target_name = self.get_target_name(groups_node)
+            if not match_targets(target_name, targets):
+                continue
+            name_elem = group_elem.find('GroupName')
+            group_name = name_elem.text if name_elem is not None else None
+            if group is not None and not fnmatch.fnmatchcase(group_name or '', group):
+                continue
+            files = group_elem.find('Files')
+            if files is None:
+                continue
+            for file_elem in files.findall('File'):
+                file_path = file_elem.findtext('FilePath', '')
+                type_text = file_elem.findtext('FileType')
+                if match_path_pattern(file_path, pattern) and match_file_type(type_text, file_type):
+                    yield file_record(target_name, group_name, file_elem.findtext('FileName'), file_path, type_text)
+    
+    def query_include_paths(self, target=None):
+        """按Target(支持通配符)查询Include路径，产出 {'kind', 'target', 'path'} 记录"""
+        targets = [target] if isinstance(target, str) else target
+        if not self.targets:
+            for path in self.get_include_paths():
+                yield {'kind': 'include', 'target': None, 'path': path}
+            return
+        for target_node, target_name in self.targets:
+            if match_targets(target_name, targets):
+                for path in self.get_include_paths(target_node):
+                    yield {'kind': 'include', 'target': target_name, 'path': path}
+    
+    def query_path_groups(self, path):
+        """查询包含该文件的所有组（通过文件索引），path可为工程中记录的路径或磁盘路径"""
+        key = normalize_path_key(path)
+        if key not in self.file_index:
+            _, key = self.resolve_path(path)
+        records = []
+        for group, file_elem in self.file_index.get(key, []):
+            name_elem = group.find('GroupName')
+            records.append(file_record(self.get_target_name(self.group_parents.get(group)),
+                                       name_elem.text if name_elem is not None else None,
+                                       file_elem.findtext('FileName'), file_elem.findtext('FilePath', ''),
+                                       file_elem.findtext('FileType')))
+        return records
+    
+    def is_modified(self):
+        """工程内容自加载后是否发生变化"""
+        if self.modified:
+            return True
+        indexes = list(self.include_indexes.values())
+        if self._default_include_index is not None:
+            indexes.append(self._default_include_index)
+        return any(index.dirty for index in indexes)
+    
+    def serialize(self):
+        """序列化工程文件，沿用原始XML声明、缩进、换行和空元素风格"""
+        if self.indent_unit is not None:
+            indent_new_elements(self.root, self.indent_unit)
+        body = self.xml.tostring(self.root, self.short_empty_elements, self.empty_element_space)
+        text = self.prolog + body + self.epilog
+        if self.newline != '\n':
+            text = text.replace('\n', self.newline)
+        return text.encode(self.encoding, errors='xmlcharrefreplace')
+    
+    @timed('save')
     def save(self):
-        """保存工程文件"""
-        self.tree.write(self.project_file, encoding='utf-8', xml_declaration=True)
+        """保存工程文件，内容未变化时跳过写入，返回是否写入了文件"""
+        if self.dry_run:
+            return False
+        written = False
+        if self.is_modified():
+            with ProjectLock(self.project_file, self.lock_timeout):
+                try:
+                    with open(self.project_file, 'rb') as f:
+                        current = f.read()
+                except OSError:
+                    current = self.original_data
+                if current != self.original_data:
+                    if self.merge_on_save:
+                        self.merge_into(current)
+                    else:
+                        print(f"警告：工程文件 {self.project_file} 在加载后被其他进程修改，将被覆盖(使用--merge可合并)")
+                # 将Include路径索引写回XML
+                for index in self.include_indexes.values():
+                    index.flush()
+                if self._default_include_index is not None:
+                    self._default_include_index.flush()
+                data = self.serialize()
+                if data != current:
+                    self._write_atomic(data)
+                    written = True
+                    self.stats.count('bytes_written', len(data))
+                self.original_data = data
+                self.modified = False
+        # 已保存的操作无需再重放
+        self.journal = []
+        if not written and self.verbose:
+            print("信息：工程文件内容未变化，跳过保存")
+        # 记录工程文件哈希，供下次增量扫描校验
+        if self.manifest is not None:
+            self.manifest.save(hash_data(self.original_data))
+        return written
+    
+    def merge_into(self, data):
+        """在磁盘上的最新工程内容上重放本次记录的操作，并改用重放后的状态"""
+        journal = self.journal
+        fresh = KeilProjectManager(self.project_file, data=data, **self._options)
+        # 重放的操作已经输出过信息，不再重复
+        with redirect_stdout(io.StringIO()):
+            for name, args, kwargs in journal:
+                getattr(fresh, name)(*args, **kwargs)
+        self.__dict__.update(fresh.__dict__)
+        self.modified = True
+        self.stats.count('merges')
+        print(f"信息：工程文件在加载后被其他进程修改，已在最新版本上重放{len(journal)}个操作")
+    
+    def _write_atomic(self, data):
+        """先写入同目录临时文件再原子替换，避免写入中途崩溃损坏工程文件"""
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(self.project_file) + '.',
+                                        suffix='.tmp', dir=self.project_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            shutil.copymode(self.project_file, tmp_path)
+            os.replace(tmp_path, self.project_file)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
+    @journaled
     def remove_group_by_name(self, group_name):
-        """根据组名移除组"""
-        groups_node = self.root.find('.//Groups')
-        if groups_node is None:
-            return False
-            
+        """根据组名从所有选中的Target中移除组，返回是否至少移除了一个"""
         removed = False
-        for group in groups_node.findall('Group'):
-            name_elem = group.find('GroupName')
-            if name_elem is not None and name_elem.text == group_name:
-                groups_node.remove(group)
+        for groups_node in self.get_groups_nodes():
+            group = self.find_group(groups_node, group_name)
+            if group is not None:
+                self.remove_group(group)
                 removed = True
-                if args.verbose:
-                    print(f"移除组: '{group_name}'")
-                break
-        
         return removed
     
+    def remove_group(self, group):
+        """移除组及其文件索引"""
+        groups_node = self.group_parents.get(group)
+        if groups_node is None:
+            return
+        name_elem = group.find('GroupName')
+        self._unindex_group(group)
+        remove_element(groups_node, group)
+        self.modified = True
+        if self.verbose:
+            print(f"移除组: '{name_elem.text if name_elem is not None else '未知组'}'")
+    
+    def snapshot(self):
+        """记录各Target的组、文件和Include路径，用于计算变更计划"""
+        state = {}
+        for info in self.target_map.values():
+            state[info.name] = {'groups': {}, 'include_paths': self.get_include_paths(info.node)}
+        if not self.targets:
+            state[''] = {'groups': {}, 'include_paths': self.get_include_paths()}
+        for group, groups_node in self.group_parents.items():
+            target_state = state.setdefault(self.get_target_name(groups_node) or '',
+                                            {'groups': {}, 'include_paths': []})
+            name_elem = group.find('GroupName')
+            files = target_state['groups'].setdefault(name_elem.text if name_elem is not None else '', [])
+            files_node = group.find('Files')
+            if files_node is None:
+                continue
+            for file_elem in files_node.findall('File'):
+                file_path_elem = file_elem.find('FilePath')
+                if file_path_elem is not None and file_path_elem.text:
+                    files.append(file_path_elem.text)
+        return state
+    
     def find_group_by_folder_name(self, folder_path):
         """根据文件夹名查找组"""
         folder_name = os.path.basename(folder_path)
-        groups_node = self.root.find('.//Groups')
-        if groups_node is None:
-            return None
+        for groups_node in self.get_groups_nodes():
+            if self.find_group(groups_node, folder_name) is not None:
+                return folder_name
+        return None
+
+def diff_snapshots(before, after):
+    """比较两次快照，返回按Target组织的变更计划（只包含有变化的Target）"""
+    def diff_lists(old, new):
+        old_keys = {normalize_path_key(p) for p in old}
+        new_keys = {normalize_path_key(p) for p in new}
+        return ([p for p in new if normalize_path_key(p) not in old_keys],
+                [p for p in old if normalize_path_key(p) not in new_keys])
+    
+    plan = []
+    for target_name in list(dict.fromkeys(list(before) + list(after))):
+        old = before.get(target_name, {'groups': {}, 'include_paths': []})
+        new = after.get(target_name, {'groups': {}, 'include_paths': []})
+        groups = []
+        for group_name in list(dict.fromkeys(list(old['groups']) + list(new['groups']))):
+            if group_name not in new['groups']:
+                status = 'removed'
+            elif group_name not in old['groups']:
+                status = 'added'
+            else:
+                status = 'modified'
+            added, removed = diff_lists(old['groups'].get(group_name, []), new['groups'].get(group_name, []))
+            if added or removed or status != 'modified':
+                groups.append({'group': group_name, 'status': status, 'added': added, 'removed': removed})
+        added, removed = diff_lists(old['include_paths'], new['include_paths'])
+        if groups or added or removed:
+            plan.append({'target': target_name, 'groups': groups,
+                         'include_paths': {'added': added, 'removed': removed}})
+    return plan
+
+
+def summarize_plan(plan):
+    """统计变更计划中的增删数量"""
+    summary = {'groups_added': 0, 'groups_removed': 0, 'files_added': 0, 'files_removed': 0,
+               'include_paths_added': 0, 'include_paths_removed': 0}
+    for target in plan:
+        for group in target['groups']:
+            if group['status'] in ('added', 'removed'):
+                summary[f"groups_{group['status']}"] += 1
+            summary['files_added'] += len(group['added'])
+            summary['files_removed'] += len(group['removed'])
+        summary['include_paths_added'] += len(target['include_paths']['added'])
+        summary['include_paths_removed'] += len(target['include_paths']['removed'])
+    return summary
+
+
+def format_plan(project_file, plan):
+    """将变更计划格式化为类似统一diff的文本"""
+    name = os.path.basename(project_file)
+    lines = [f"--- {name}", f"+++ {name} (计划)"]
+    status_text = {'added': ' (新建)', 'removed': ' (删除)', 'modified': ''}
+    for target in plan:
+        target_info = f"Target '{target['target']}' " if target['target'] else ''
+        for group in target['groups']:
+            lines.append(f"@@ {target_info}组 '{group['group']}'{status_text[group['status']]} @@")
+            lines.extend(f"-{p}" for p in group['removed'])
+            lines.extend(f"+{p}" for p in group['added'])
+        include_paths = target['include_paths']
+        if include_paths['added'] or include_paths['removed']:
+            lines.append(f"@@ {target_info}Include路径 @@")
+            lines.extend(f"-{p}" for p in include_paths['removed'])
+            lines.extend(f"+{p}" for p in include_paths['added'])
+    summary = summarize_plan(plan)
+    if plan:
+        lines.append(f"待处理变更: 新增{summary['files_added']}个文件, 移除{summary['files_removed']}个文件, "
+                     f"新增{summary['groups_added']}个组, 移除{summary['groups_removed']}个组, "
+                     f"新增{summary['include_paths_added']}个Include路径, 移除{summary['include_paths_removed']}个Include路径")
+    else:
+        lines = ["无待处理变更"]
+    return '\n'.join(lines)
+
+
+def iter_project_items(project_file, xml=None):
+    """使用iterparse流式读取工程文件（路径或文件对象），在元素闭合时产出条目并释放已处理的子树
+
+    产出 (类型, Target名, 数据)：
+      ('target', 名称, None)
+      ('include', Target名, [Include路径])
+      ('define', Target名, [宏定义])
+      ('group', Target名, (组名, [(文件名, 文件路径, 文件类型)]))
+    """
+    stack = []
+    target_name = None
+    xml = xml or get_xml_backend()
+    for event, elem in xml.iterparse(project_file, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem.tag)
+            continue
+        stack.pop()
+        tag = elem.tag
+        parent = stack[-1] if stack else None
+        if tag == 'TargetName' and parent == 'Target':
+            target_name = elem.text
+            yield 'target', target_name, None
+        elif tag == 'IncludePath' and stack[-2:] == ['Cads', 'VariousControls'] and 'Group' not in stack:
+            paths = [p.strip() for p in (elem.text or '').split(';') if p.strip()]
+            yield 'include', target_name, paths
+        elif tag == 'Define' and stack[-2:] == ['Cads', 'VariousControls'] and 'Group' not in stack:
+            defines = [d for d in re.split(r'[,\s]+', elem.text or '') if d]
+            yield 'define', target_name, defines
+        elif tag == 'Group' and parent == 'Groups':
+            name_elem = elem.find('GroupName')
+            group_name = name_elem.text if name_elem is not None else "未知组"
+            files = []
+            for file_elem in elem.iterfind('Files/File'):
+                file_name = file_elem.find('FileName')
+                file_path = file_elem.find('FilePath')
+                files.append((file_name.text if file_name is not None else "未知文件",
+                              file_path.text if file_path is not None else "",
+                              file_elem.findtext('FileType')))
+            yield 'group', target_name, (group_name, files)
+            elem.clear()
+        elif tag == 'Target':
+            target_name = None
+            elem.clear()
+        elif len(stack) == 1:
+            # 释放根节点下已处理完的顶层子树
+            elem.clear()
+
+
+def cached_project_items(project_file, use_snapshot=True):
+    """产出工程条目：快照有效时直接读取快照，否则流式解析（边解析边产出）并增量重建快照"""
+    if not use_snapshot:
+        yield from iter_project_items(project_file)
+        return
+    snapshot = ProjectSnapshot(os.path.abspath(project_file))
+    items = snapshot.load()
+    if items is not None:
+        yield from items
+        return
+    yield from snapshot.record(project_file)
+
+
+def filter_project_items(items, targets=None, group=None, pattern=None):
+    """在流式读取过程中按Target、组名和路径通配符过滤工程条目"""
+    for kind, target_name, data in items:
+        if not match_targets(target_name, targets):
+            continue
+        if kind == 'group':
+            group_name, files = data
+            if group is not None and not fnmatch.fnmatchcase(group_name, group):
+                continue
+            if pattern is not None:
+                files = [f for f in files if match_path_pattern(f[1], pattern)]
+                if not files:
+                    continue
+            data = (group_name, files)
+        elif kind == 'include' and (group is not None or pattern is not None):
+            # 按组或路径筛选时只输出文件
+            continue
+        yield kind, target_name, data
+
+
+def iter_project_records(items):
+    """将工程条目转换为查询记录"""
+    for kind, target_name, data in items:
+        if kind == 'target':
+            yield {'kind': 'target', 'target': target_name}
+        elif kind == 'include':
+            for path in data:
+                yield {'kind': 'include', 'target': target_name, 'path': path}
+        elif kind == 'group':
+            group_name, files = data
+            for file_name, file_path, file_type in files:
+                yield file_record(target_name, group_name, file_name, file_path, file_type)
+
+
+def stream_project_records(project_file, output_format='ndjson', targets=None, group=None, pattern=None,
+                           use_snapshot=True):
+    """流式输出过滤后的查询记录：ndjson每行一条记录，json为单个文档，返回退出码"""
+    items = filter_project_items(cached_project_items(project_file, use_snapshot), targets, group, pattern)
+    out = sys.stdout
+    try:
+        if output_format == 'json':
+            out.write('{"project": ' + json.dumps(os.path.abspath(project_file), ensure_ascii=False) + ', "records": [')
+            for i, record in enumerate(iter_project_records(items)):
+                out.write((',' if i else '') + '\n  ' + json.dumps(record, ensure_ascii=False))
+            out.write('\n]}\n')
+        else:
+            for record in iter_project_records(items):
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+    except XML_PARSE_ERRORS as e:
+        print(f"错误：无法解析项目文件 {project_file}，原因：{str(e)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def stream_project_listing(project_file, use_snapshot=True, targets=None, group=None, pattern=None):
+    """流式列出工程中的Target、Include路径和文件（可按Target、组名和路径通配符过滤），返回退出码"""
+    print(f"项目文件: {project_file}")
+    target_count = include_count = file_count = 0
+    try:
+        items = filter_project_items(cached_project_items(project_file, use_snapshot), targets, group, pattern)
+        for kind, target_name, data in items:
+            if kind == 'target':
+                target_count += 1
+                print(f"\nTarget '{target_name}':")
+            elif kind == 'define':
+                continue
+            elif kind == 'include':
+                if not data:
+                    continue
+                print(f"\n{'Include路径' if target_name else '所有Include路径'}:")
+                for path in data:
+                    print(f"  - {path}")
+                include_count += len(data)
+            else:
+                group_name, files = data
+                if not files:
+                    print(f"\n组 '{group_name}': 无文件")
+                    continue
+                print(f"\n组 '{group_name}' ({len(files)}个文件):")
+                for file_name, file_path, _ in files:
+                    print(f"  - {file_name} ({file_path})")
+                file_count += len(files)
+    except XML_PARSE_ERRORS as e:
+        print(f"错误：无法解析项目文件 {project_file}，原因：{str(e)}")
+        return 1
+    
+    print(f"\n总计: {target_count}个Target, {include_count}个Include路径, {file_count}个文件")
+    return 0
+
+
+COMPILE_COMMAND_EXTENSIONS = ('.c', '.cpp', '.cc', '.cxx')
+
+
+def export_compile_commands(project_file, output_dir=None, compiler='clang', use_snapshot=True, targets=None):
+    """流式读取工程，为每个Target生成compile_commands.json（供clangd等工具使用），返回退出码
+
+    输出到 output_dir/<Target名>/compile_commands.json，默认output_dir为工程所在目录；
+    targets为Target名通配符列表时只导出匹配的Target。
+    """
+    project_dir = os.path.dirname(os.path.abspath(project_file))
+    output_dir = os.path.abspath(output_dir or project_dir)
+    resolved_dirs = {}
+    
+    def resolve_dir(rel_dir):
+        # 同一目录下的文件只解析一次路径
+        abs_dir = resolved_dirs.get(rel_dir)
+        if abs_dir is None:
+            abs_dir = os.path.normpath(os.path.join(project_dir, rel_dir))
+            resolved_dirs[rel_dir] = abs_dir
+        return abs_dir
+    
+    writer = None
+    
+    def close_writer():
+        out, tmp_path, path, count, target_name = writer
+        out.write('\n]\n')
+        out.close()
+        os.replace(tmp_path, path)
+        print(f"Target '{target_name}': {count}个编译条目 -> {path}")
+    
+    target_name = None
+    defines = []
+    includes = []
+    exported = 0
+    try:
+        for kind, name, data in filter_project_items(cached_project_items(project_file, use_snapshot), targets):
+            if kind == 'target':
+                if writer is not None:
+                    close_writer()
+                    writer = None
+                target_name = name
+                defines = []
+                includes = []
+            elif kind == 'define':
+                defines = [f'-D{d}' for d in data]
+            elif kind == 'include':
+                includes = ['-I' + resolve_dir(p.replace('\\', '/')) for p in data]
+            else:
+                _, files = data
+                for _, file_path, _ in files:
+                    if not file_path.lower().endswith(COMPILE_COMMAND_EXTENSIONS):
+                        continue
+                    if writer is None:
+                        label = target_name or 'default'
+                        target_dir = os.path.join(output_dir, re.sub(r'[^\w.-]', '_', label))
+                        os.makedirs(target_dir, exist_ok=True)
+                        path = os.path.join(target_dir, 'compile_commands.json')
+                        fd, tmp_path = tempfile.mkstemp(prefix='.compile_commands.', suffix='.tmp', dir=target_dir)
+                        out = os.fdopen(fd, 'w', encoding='utf-8')
+                        out.write('[')
+                        writer = [out, tmp_path, path, 0, label]
+                    rel_dir, file_name = os.path.split(file_path.replace('\\', '/'))
+                    abs_file = os.path.join(resolve_dir(rel_dir), file_name)
+                    entry = {'directory': project_dir, 'file': abs_file,
+                             'arguments': [compiler, '--target=arm-none-eabi', *defines, *includes, '-c', abs_file]}
+                    writer[0].write((',' if writer[3] else '') + '\n  ' + json.dumps(entry, ensure_ascii=False))
+                    writer[3] += 1
+                    exported += 1
+        if writer is not None:
+            close_writer()
+            writer = None
+    except XML_PARSE_ERRORS as e:
+        print(f"错误：无法解析项目文件 {project_file}，原因：{str(e)}")
+        return 1
+    finally:
+        if writer is not None:
+            writer[0].close()
+            os.remove(writer[1])
+    
+    print(f"总计: 导出{exported}个编译条目")
+    return 0
+
+
+def watch_folders(manager, folders, group_name=None, recursive=False, debounce=0.5, interval=1.0, polling=False):
+    """监视模式：工程只加载一次，文件夹发生变化时增量应用增删并在每批变化后保存一次
+
+    优先使用inotify，不可用时回退为轮询。按Ctrl+C退出。
+    """
+    if recursive:
+        extensions = ('.c', '.cpp', '.h', '.hpp', '.s')
+    else:
+        extensions = ('.c', '.cpp', '.h', '.hpp', '.s', '.asm')
+    folders = [os.path.abspath(f) for f in folders]
+    
+    # 初次完整扫描，使项目与文件夹一致
+    states = {}
+    for folder in folders:
+        name = group_name if group_name and len(folders) == 1 else os.path.basename(folder)
+        ignore = manager.get_ignore_matcher(folder)
+        manager.add_include_path(folder)
+        state, changed = scan_source_tree_incremental(folder, extensions, {}, manager.jobs, ignore)
+        added, _ = manager.apply_scan_changes(folder, name, recursive, {}, state, changed)
+        states[folder] = (name, state)
+        print(f"监视: {folder} ({len(state)}个目录, 新增{added}个文件)")
+    manager.save()
+    
+    watcher = None
+    if not polling:
+        try:
+            watcher = InotifyWatcher()
+            for _, state in states.values():
+                for dirpath in state:
+                    watcher.watch(dirpath)
+        except OSError as e:
+            print(f"信息：inotify不可用({str(e)})，改用轮询")
+            if watcher is not None:
+                watcher.close()
+            watcher = None
+    if watcher is None:
+        watcher = PollingWatcher(interval)
+        for _, state in states.values():
+            for dirpath in state:
+                watcher.watch(dirpath)
+    
+    print("开始监视文件变化，按Ctrl+C退出")
+    try:
+        while True:
+            dirty = watcher.wait()
+            # 去抖：持续收集事件，直到安静debounce秒
+            while dirty:
+                more = watcher.wait(debounce)
+                if more is None:
+                    dirty = None
+                elif more:
+                    dirty |= more
+                    continue
+                break
+            if dirty is not None and not dirty:
+                continue
             
-        for group in groups_node.findall('Group'):
-            name_elem = group.find('GroupName')
-            if name_elem is not None and name_elem.text == folder_name:
-                return name_elem.text
+            added_files = removed_files = 0
+            for folder, (name, previous) in list(states.items()):
+                if dirty is not None and not any(d == folder or d.startswith(folder + os.sep) for d in dirty):
+                    continue
+                ignore = manager.get_ignore_matcher(folder)
+                state, changed = scan_source_tree_incremental(folder, extensions, previous, manager.jobs, ignore, dirty)
+                if not changed and len(state) == len(previous):
+                    continue
+                added, removed = manager.apply_scan_changes(folder, name, recursive, previous, state, changed)
+                added_files += added
+                removed_files += removed
+                states[folder] = (name, state)
+                # 同步监视的目录
+                for dirpath in previous:
+                    if dirpath not in state:
+                        watcher.unwatch(dirpath)
+                for dirpath in changed:
+                    try:
+                        watcher.watch(dirpath)
+                    except OSError as e:
+                        print(f"警告：{str(e)}")
+            
+            if manager.save():
+                print(f"[{time.strftime('%H:%M:%S')}] 新增{added_files}个文件, 移除{removed_files}个文件, 已保存")
+    except KeyboardInterrupt:
+        print("\n已停止监视")
+    finally:
+        watcher.close()
+
+
+BATCH_OPERATIONS = ('add', 'delete', 'delete-group', 'include', 'sync')
+
+
+def load_batch_file(batch_file):
+    """读取批处理文件（JSON或TOML），返回操作列表"""
+    if batch_file.lower().endswith('.toml'):
+        if tomllib is None:
+            raise ValueError("读取TOML批处理文件需要Python 3.11及以上版本")
+        with open(batch_file, 'rb') as f:
+            data = tomllib.load(f)
+    else:
+        with open(batch_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    operations = data.get('operations') if isinstance(data, dict) else data
+    if not isinstance(operations, list):
+        raise ValueError("批处理文件必须是操作列表或包含operations列表")
+    return operations
+
+
+def run_batch(manager, operations, base_dir):
+    """在同一个KeilProjectManager上依次执行批处理操作
+
+    文件夹路径相对于base_dir解析。返回 [(操作描述, 是否成功, 结果信息)]。
+    """
+    results = []
+    for number, op in enumerate(operations, 1):
+        kind = op.get('op') if isinstance(op, dict) else None
+        folder = op.get('folder') if isinstance(op, dict) else None
+        group = op.get('group') if isinstance(op, dict) else None
+        label = f"[{number}] {kind} {folder or group or ''}".rstrip()
+        try:
+            if kind not in BATCH_OPERATIONS:
+                raise ValueError(f"未知操作 '{kind}'，可用操作: {', '.join(BATCH_OPERATIONS)}")
+            if kind == 'delete-group':
+                if not group:
+                    raise ValueError("delete-group操作需要指定group")
+                if not manager.remove_group_by_name(group):
+                    raise ValueError(f"未找到组 '{group}'")
+                results.append((label, True, f"已删除组 '{group}'"))
+                continue
+            
+            if not folder:
+                raise ValueError(f"{kind}操作需要指定folder")
+            folder_path = os.path.abspath(os.path.join(base_dir, folder))
+            if not os.path.exists(folder_path):
+                raise ValueError(f"文件夹 {folder_path} 不存在")
+            recursive = bool(op.get('recursive', False))
+            
+            if kind == 'add':
+                added = manager.add_folder(folder_path, group, recursive, bool(op.get('incremental', False)),
+                                           bool(op.get('prune_groups', False)))
+                message = f"新增{added}个文件"
+            elif kind == 'delete':
+                removed, deleted_group = manager.delete_folder(folder_path, group)
+                message = f"移除{removed}个文件" + (f", 已删除组 '{deleted_group}'" if deleted_group else "")
+            elif kind == 'include':
+                manager.add_include_path(folder_path)
+                message = "已添加Include路径"
+            else:
+                added, removed, added_includes, removed_includes = manager.sync_folder(folder_path, group, recursive)
+                message = (f"新增{added}个文件, 移除{removed}个文件, "
+                           f"新增{added_includes}个Include路径, 移除{removed_includes}个Include路径")
+            results.append((label, True, message))
+        except Exception as e:
+            results.append((label, False, str(e)))
+    return results
+
+
+def resolve_project_files(patterns):
+    """解析工程文件参数：支持多个路径、通配符和.uvmpw多工程工作区"""
+    projects = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+        else:
+            matches = [pattern]
+        for path in matches:
+            if path.lower().endswith('.uvmpw') and os.path.isfile(path):
+                projects.extend(read_workspace_projects(path))
+            else:
+                projects.append(os.path.abspath(path))
+    # 去重并保持顺序
+    return list(dict.fromkeys(projects))
+
+
+def read_workspace_projects(workspace_file):
+    """读取µVision多工程工作区(.uvmpw)中的工程文件列表"""
+    workspace_dir = os.path.dirname(os.path.abspath(workspace_file))
+    root = ET.parse(workspace_file).getroot()
+    projects = []
+    for node in root.iter('PathAndName'):
+        if node.text and node.text.strip():
+            path = node.text.strip().replace('\\', os.sep)
+            projects.append(os.path.abspath(os.path.join(workspace_dir, path)))
+    return projects
+
+
+def run_project(manager, args):
+    """对单个工程执行命令行指定的操作，返回退出码"""
+    if manager.targets and not manager.selected_targets:
+        print(f"错误：没有与 {', '.join(args.target)} 匹配的Target")
+        return 1
+    
+    # 监视模式
+    if args.watch is not None:
+        folders = list(args.watch)
+        if args.folder:
+            folders.insert(0, args.folder)
+        if not folders:
+            print("错误：需要指定要监视的文件夹")
+            return 1
+        for folder in folders:
+            if not os.path.isdir(folder):
+                print(f"错误：文件夹 {folder} 不存在")
+                return 1
+        watch_folders(manager, folders, args.group, args.recursive, args.debounce, args.poll_interval, args.poll)
+        return 0
+    
+    # 批处理模式
+    if args.batch:
+        operations = load_batch_file(args.batch)
+        base_dir = os.path.dirname(os.path.abspath(args.batch))
+        results = run_batch(manager, operations, base_dir)
+        failed = 0
+        for label, ok, message in results:
+            if not ok:
+                failed += 1
+            print(f"{label}: {'成功' if ok else '失败'} - {message}")
+        manager.save()
+        print(f"\n批处理完成: {len(results) - failed}个操作成功, {failed}个操作失败")
+        if failed:
+            return 1
+        return 0
+    
+    # 压缩模式
+    if args.compact:
+        bytes_before = len(manager.original_data)
+        counts = manager.compact()
+        manager.save()
+        elements = counts['missing_files'] + counts['duplicate_files'] + counts['empty_groups']
+        print(f"已压缩项目 {manager.project_file}: 移除{elements}个元素(不存在的文件{counts['missing_files']}个, "
+              f"重复文件{counts['duplicate_files']}个, 空组{counts['empty_groups']}个), "
+              f"{counts['include_paths']}个Include路径, 减少{bytes_before - len(manager.original_data)}字节")
+        return 0
+    
+    # 检查文件夹参数
+    if not args.folder:
+        print("错误：需要指定文件夹路径")
+        return 1
         
-        return None
+    if not os.path.exists(args.folder):
+        print(f"错误：文件夹 {args.folder} 不存在")
+        return 1
+    
+    # 转换为绝对路径
+    folder_path = os.path.abspath(args.folder)
+    
+    if args.verbose:
+        print(f"项目文件: {manager.project_file}")
+        print(f"处理文件夹: {folder_path}")
+        if args.group:
+            print(f"组名称: {args.group}")
+        print(f"模式: {'同步' if args.sync else '删除' if args.delete else '添加'}")
+        print(f"递归模式: {'是' if args.recursive else '否'}")
+        
+        # 显示项目中的所有Target
+        targets = manager.targets
+        if targets:
+            print(f"\n项目中的Target ({len(targets)}):")
+            selected = {info.name for info in manager.selected_targets}
+            for _, target_name in targets:
+                print(f"  - {target_name}{'' if target_name in selected else ' (未选中)'}")
+    
+    if args.delete_group:
+        # 删除指定组
+        if manager.remove_group_by_name(args.delete_group):
+            manager.save()
+            print(f"已成功从项目 {manager.project_file} 中删除组 '{args.delete_group}'")
+        else:
+            print(f"错误：未找到组 '{args.delete_group}'")
+        return 0
+    
+    if not args.delete and not manager.get_groups_nodes(create=True):
+        # 添加和同步需要Groups节点，找不到时视为失败而不是报告成功
+        print("错误：未找到Groups节点")
+        return 1
+        
+    if args.sync:
+        # 同步模式
+        added_files, removed_files, added_includes, removed_includes = manager.sync_folder(
+            folder_path, args.group, args.recursive)
+        manager.save()
+        print(f"已同步 {args.folder} 与项目 {manager.project_file}: 新增{added_files}个文件, 移除{removed_files}个文件, "
+              f"新增{added_includes}个Include路径, 移除{removed_includes}个Include路径")
+    elif args.delete:
+        # 删除模式
+        removed_files, deleted_group = manager.delete_folder(folder_path, args.group)
+        manager.save()
+        
+        group_info = f", 已删除组 '{deleted_group}'" if deleted_group else ""
+        print(f"已成功从项目 {manager.project_file} 中删除 {args.folder} 相关的文件和路径{group_info} (移除了{removed_files}个文件)")
+    else:
+        # 添加模式
+        manager.add_folder(folder_path, args.group, args.recursive, args.incremental, args.prune_groups)
+        manager.save()
+        print(f"已成功将 {args.folder} 中的文件添加到项目 {manager.project_file}")
+    
+    # 显示添加的Include路径
+    if args.verbose:
+        targets = manager.targets
+        if not targets:
+            paths = manager.get_include_paths()
+            if paths:
+                print("\n当前Include路径:")
+                for path in paths:
+                    print(f"  - {path}")
+        else:
+            for info in manager.selected_targets:
+                paths = manager.get_include_paths(info.node)
+                if paths:
+                    print(f"\nTarget '{info.name}' 的Include路径:")
+                    for path in paths:
+                        print(f"  - {path}")
+    return 0
+
+
+# 试运行发现待处理变更时的退出码，与错误(1)区分
+EXIT_PENDING_CHANGES = 2
+
+
+def plan_project(manager, args):
+    """试运行：只在内存中执行操作并输出变更计划，不写入任何工程文件；存在待处理变更时返回EXIT_PENDING_CHANGES"""
+    if args.watch is not None:
+        print("错误：监视模式不支持试运行")
+        return 1
+    before = manager.snapshot()
+    # 操作本身的输出在试运行中意义不大，仅在详细模式下保留
+    buffer = io.StringIO()
+    quiet = args.dry_run == 'json' or not args.verbose
+    with redirect_stdout(buffer) if quiet else nullcontext():
+        code = run_project(manager, args)
+    if code:
+        print(buffer.getvalue(), end='')
+        return code
+    plan = diff_snapshots(before, manager.snapshot())
+    if args.dry_run == 'json':
+        document = {'project': manager.project_file, 'pending': bool(plan),
+                    'summary': summarize_plan(plan), 'targets': plan}
+        print(json.dumps(document, ensure_ascii=False, indent=2))
+    else:
+        print(format_plan(manager.project_file, plan))
+    return EXIT_PENDING_CHANGES if plan else 0
+
+
+def execute_project(project_path, args):
+    """处理单个工程（列出模式或修改操作），按需输出运行统计，返回退出码"""
+    stats = RunStats() if args.stats else None
+    select_xml_backend(args.xml_backend)
+    if args.list:
+        # 列出模式，流式解析无需构建完整的树
+        with stats.phase('list') if stats else nullcontext():
+            if args.format == 'text':
+                code = stream_project_listing(project_path, not args.no_snapshot, args.target, args.group, args.pattern)
+            else:
+                code = stream_project_records(project_path, args.format, args.target, args.group, args.pattern,
+                                              not args.no_snapshot)
+    elif args.compile_commands is not None:
+        with stats.phase('export') if stats else nullcontext():
+            code = export_compile_commands(project_path, args.compile_commands or None,
+                                           use_snapshot=not args.no_snapshot, targets=args.target)
+    else:
+        manager = KeilProjectManager(project_path, verbose=args.verbose, jobs=args.jobs,
+                                     exclude=args.exclude, stats=stats, analyze_includes=args.analyze_includes,
+                                     reachable_headers_only=args.reachable_headers, dry_run=bool(args.dry_run),
+                                     merge_on_save=args.merge, lock_timeout=args.lock_timeout,
+                                     target_patterns=args.target)
+        code = plan_project(manager, args) if args.dry_run else run_project(manager, args)
+    if stats is not None:
+        if args.stats == 'json':
+            print(json.dumps(stats.as_dict(), ensure_ascii=False))
+        else:
+            print(stats.format_table())
+    return code
+
+
+def process_project(project_path, args):
+    """在工作进程中处理单个工程，返回 (工程路径, 退出码, 输出文本)"""
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        try:
+            if not os.path.exists(project_path):
+                print(f"错误：项目文件 {project_path} 不存在")
+                code = 1
+            else:
+                code = execute_project(project_path, args)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            print(f"错误：处理过程中发生异常：{str(e)}")
+            traceback.print_exc(file=buffer)
+            code = 1
+    return project_path, code, buffer.getvalue()
+
 
 def main():
     # 解析命令行参数
     parser = argparse.ArgumentParser(description='Keil项目文件助手 - 添加/删除文件到Keil项目')
-    parser.add_argument('-p', '--project', required=True, help='Keil项目文件路径(.uvprojx)')
+    parser.add_argument('-p', '--project', required=True, nargs='+',
+                        help='Keil项目文件路径(.uvprojx)，可指定多个、使用通配符或.uvmpw工作区')
     parser.add_argument('-f', '--folder', help='要处理的文件夹路径')
     parser.add_argument('-g', '--group', help='指定添加到的组名称(不指定则使用文件夹名)')
     parser.add_argument('-r', '--recursive', action='store_true', help='递归创建文件夹结构(默认为添加到单一组)')
     parser.add_argument('-v', '--verbose', action='store_true', help='显示详细信息')
+    parser.add_argument('--prune-groups', action='store_true', help='递归模式下移除对应目录已不存在的组')
     parser.add_argument('-d', '--delete', action='store_true', help='删除模式(删除指定文件夹中的文件和Include路径)')
     parser.add_argument('-l', '--list', action='store_true', help='列出项目中的所有Target、Include路径和文件')
+    parser.add_argument('-e', '--compile-commands', nargs='?', const='', metavar='DIR',
+                        help='为每个Target导出compile_commands.json到DIR/<Target名>/(默认工程所在目录)，供clangd等工具使用')
+    parser.add_argument('--format', choices=['text', 'json', 'ndjson'], default='text',
+                        help='列出模式的输出格式(text、单个JSON文档或每行一条记录的ndjson，默认text)')
+    parser.add_argument('-t', '--target', action='append', default=[],
+                        help='只对名称匹配的Target执行操作或列出(支持通配符，可多次指定，默认所有Target)')
+    parser.add_argument('--pattern', help='列出模式下按文件路径筛选(支持通配符，忽略大小写)；-g在列出模式下按组名筛选')
+    parser.add_argument('--no-snapshot', action='store_true',
+                        help='只读命令(-l/-e)不使用工程快照缓存(<工程>.snapshot.json)，总是重新解析工程文件')
     parser.add_argument('--delete-group', help='删除指定名称的组')
+    parser.add_argument('-s', '--sync', action='store_true', help='同步模式(一次性添加新文件、移除已删除文件的条目并修剪Include路径)')
+    parser.add_argument('-c', '--compact', action='store_true',
+                        help='压缩模式(Include路径去重、移除不存在的文件和目录、重复文件条目及空组)')
+    parser.add_argument('-i', '--incremental', action='store_true', help='增量模式(根据扫描清单只处理变化的目录)')
+    parser.add_argument('-x', '--exclude', action='append', default=[],
+                        help='排除匹配的文件或目录(gitignore语法，可多次指定，另会读取文件夹下的.keilignore)')
+    parser.add_argument('-a', '--analyze-includes', action='store_true',
+                        help='分析#include依赖，只添加源文件实际需要的Include目录并报告未解析的包含')
+    parser.add_argument('--reachable-headers', action='store_true',
+                        help='只添加被源文件(直接或间接)包含的头文件，并报告跳过的头文件')
+    parser.add_argument('-W', '--watch', nargs='*', metavar='FOLDER',
+                        help='监视模式：保持工程在内存中，文件夹(-f及此处列出的文件夹)变化时自动增删文件')
+    parser.add_argument('--debounce', type=float, default=0.5, help='监视模式下合并连续事件的等待秒数(默认0.5)')
+    parser.add_argument('--poll', action='store_true', help='监视模式下强制使用轮询而不是inotify')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='轮询间隔秒数(默认1.0)')
+    parser.add_argument('-n', '--dry-run', '--check', dest='dry_run', nargs='?', const='diff', choices=['diff', 'json'],
+                        help='试运行：输出变更计划(diff或json，默认diff)而不写入工程文件，有待处理变更时返回退出码2(错误为1)')
+    parser.add_argument('-m', '--merge', action='store_true',
+                        help='合并保存：若工程文件在加载后被其他进程修改，在最新版本上重放本次操作后再写入')
+    parser.add_argument('--lock-timeout', type=float, default=60.0, help='等待工程文件锁的最长秒数(默认60)')
+    parser.add_argument('--xml-backend', choices=XML_BACKENDS, default='auto',
+                        help='XML解析/序列化后端(auto使用标准库，lxml需显式指定，默认auto)')
+    parser.add_argument('-b', '--batch', help='批处理文件(JSON/TOML)，一次解析和保存执行多个操作')
+    parser.add_argument('--stats', nargs='?', const='table', choices=['table', 'json'],
+                        help='输出各阶段耗时和计数统计(table或json，默认table)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='并行扫描目录的线程数(默认自动)')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='多工程模式下的并行进程数(默认自动)')
     
-    global args
     args = parser.parse_args()
     
-    # 检查项目文件是否存在
-    if not os.path.exists(args.project):
-        print(f"错误：项目文件 {args.project} 不存在")
+    projects = resolve_project_files(args.project)
+    if not projects:
+        print(f"错误：未找到匹配的项目文件 {' '.join(args.project)}")
         sys.exit(1)
     
-    # 转换项目文件为绝对路径
-    project_path = os.path.abspath(args.project)
+    if len(projects) > 1:
+        # 多工程模式，每个工程在独立的工作进程中处理
+        failed = []
+        pending = []
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for project_path, code, output in pool.map(process_project, projects, repeat(args)):
+                print(f"\n===== {project_path} =====")
+                print(output, end='')
+                if code == EXIT_PENDING_CHANGES:
+                    pending.append(project_path)
+                elif code:
+                    failed.append(project_path)
+        succeeded = len(projects) - len(failed) - len(pending)
+        pending_info = f", {len(pending)}个工程有待处理变更" if args.dry_run else ""
+        print(f"\n多工程处理完成: {succeeded}个工程成功{pending_info}, {len(failed)}个工程失败")
+        for project_path in pending:
+            print(f"  - 待处理变更: {project_path}")
+        for project_path in failed:
+            print(f"  - 失败: {project_path}")
+        if failed:
+            sys.exit(1)
+        if pending:
+            sys.exit(EXIT_PENDING_CHANGES)
+        return
+    
+    # 检查项目文件是否存在
+    project_path = projects[0]
+    if not os.path.exists(project_path):
+        print(f"错误：项目文件 {project_path} 不存在")
+        sys.exit(1)
     
     try:
-        manager = KeilProjectManager(project_path)
-        
-        # 列出模式
-        if args.list:
-            print(f"项目文件: {project_path}")
-            targets = manager.find_all_targets()
-            if targets:
-                print(f"\n项目中的Target ({len(targets)}):")
-                for _, target_name in targets:
-                    print(f"  - {target_name}")
-            
-            include_count = manager.print_all_include_paths()
-            file_count = manager.print_all_groups_and_files()
-            
-            print(f"\n总计: {len(targets) if targets else 0}个Target, {include_count}个Include路径, {file_count}个文件")
-            return
-        
-        # 检查文件夹参数
-        if not args.folder:
-            print("错误：需要指定文件夹路径")
-            sys.exit(1)
-            
-        if not os.path.exists(args.folder):
-            print(f"错误：文件夹 {args.folder} 不存在")
-            sys.exit(1)
-        
-        # 转换为绝对路径
-        folder_path = os.path.abspath(args.folder)
-        
-        if args.verbose:
-            print(f"项目文件: {project_path}")
-            print(f"处理文件夹: {folder_path}")
-            if args.group:
-                print(f"组名称: {args.group}")
-            print(f"模式: {'删除' if args.delete else '添加'}")
-            print(f"递归模式: {'是' if args.recursive else '否'}")
-            
-            # 显示项目中的所有Target
-            targets = manager.find_all_targets()
-            if targets:
-                print(f"\n项目中的Target ({len(targets)}):")
-                for _, target_name in targets:
-                    print(f"  - {target_name}")
-        
-        if args.delete_group:
-            # 删除指定组
-            if manager.remove_group_by_name(args.delete_group):
-                manager.save()
-                print(f"已成功从项目 {args.project} 中删除组 '{args.delete_group}'")
-            else:
-                print(f"错误：未找到组 '{args.delete_group}'")
-            return
-            
-        if args.delete:
-            # 删除模式
-            removed_files = manager.remove_files_in_folder(folder_path)
-            manager.remove_include_path(folder_path)
-            
-            # 如果指定了组名，删除该组
-            group_deleted = False
-            if args.group:
-                group_deleted = manager.remove_group_by_name(args.group)
-            else:
-                # 尝试查找与文件夹名相同的组并删除
-                folder_name = os.path.basename(folder_path)
-                group_deleted = manager.remove_group_by_name(folder_name)
-            
-            manager.save()
-            
-            group_info = ""
-            if args.group and group_deleted:
-                group_info = f", 已删除组 '{args.group}'"
-            elif group_deleted:
-                group_info = f", 已删除组 '{os.path.basename(folder_path)}'"
-                
-            print(f"已成功从项目 {args.project} 中删除 {args.folder} 相关的文件和路径{group_info} (移除了{removed_files}个文件)")
-        else:
-            # 添加模式
-            if args.recursive:
-                # 使用原始方法，递归创建文件夹结构
-                manager.scan_and_add_files(folder_path)
-            else:
-                # 使用新方法，将所有文件添加到单一组
-                manager.scan_and_add_files_to_single_group(folder_path, args.group)
-                
-            manager.save()
-            print(f"已成功将 {args.folder} 中的文件添加到项目 {args.project}")
-        
-        # 显示添加的Include路径
-        if args.verbose:
-            targets = manager.find_all_targets()
-            if not targets:
-                include_node = manager.find_include_path_node()
-                if include_node is not None and include_node.text:
-                    print("\n当前Include路径:")
-                    for path in include_node.text.split(';'):
-                        if path.strip():
-                            print(f"  - {path}")
-            else:
-                for target_node, target_name in targets:
-                    include_node = manager.find_include_path_node_for_target(target_node)
-                    if include_node is not None and include_node.text:
-                        print(f"\nTarget '{target_name}' 的Include路径:")
-                        for path in include_node.text.split(';'):
-                            if path.strip():
-                                print(f"  - {path}")
+        code = execute_project(project_path, args)
     except Exception as e:
         print(f"错误：处理过程中发生异常：{str(e)}")
-        import traceback
         traceback.print_exc()
         sys.exit(1)
+    if code:
+        sys.exit(code)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()